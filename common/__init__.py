@@ -1,2 +1,4 @@
 from .cpt_searcher import *
 from .task_blacklists import *
+from .cpt_crawler import *
+from .cpt_index import *
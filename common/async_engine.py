@@ -0,0 +1,187 @@
+import os
+import os.path as osp
+import time
+import signal
+import asyncio
+import subprocess
+
+from common import watchdog as wd
+from common.mem_admission import mem_available_kb, default_headroom_kb
+
+# Run a batch of SimulatorTask from one controller process with asyncio,
+# instead of keeping one Pool worker blocked on each simulator.
+# Markers (running/completed/aborted/timeout), simulator_out.txt/simulator_err.txt
+# and run history are the same as SimulatorTask.run.
+# Simulators are reaped with os.wait4 here rather than by an asyncio child
+# watcher, so that their rusage is recorded; a pidfd wakes the event loop when
+# one exits. Marker and history I/O, which may be on NFS, runs in the executor.
+
+
+class AsyncMemoryGate:
+    # common.mem_admission.MemoryGate for the tasks of one event loop
+    def __init__(self, budget_kb=None, headroom_kb=default_headroom_kb):
+        if budget_kb is None:
+            budget_kb = mem_available_kb() - headroom_kb
+        self.budget_kb = budget_kb
+        self.reserved = 0
+        self.cond = asyncio.Condition()
+
+    async def admit(self, mem_kb):
+        async with self.cond:
+            # an idle machine always admits, or a huge task would never start
+            await self.cond.wait_for(
+                    lambda: self.reserved == 0 or self.reserved + mem_kb <= self.budget_kb)
+            self.reserved += mem_kb
+
+    async def release(self, mem_kb):
+        async with self.cond:
+            self.reserved -= mem_kb
+            self.cond.notify_all()
+
+
+async def wait4(pid):
+    # returns (status, rusage) of the child
+    loop = asyncio.get_running_loop()
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is None:
+        # no pidfd: poll
+        while True:
+            wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if wpid == pid:
+                return status, rusage
+            await asyncio.sleep(1)
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage
+
+
+async def terminate(proc, waiting):
+    # waiting: the wait4 future of proc
+    if waiting.done():
+        return
+    os.kill(proc.pid, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(waiting), wd.kill_grace_period)
+    except asyncio.TimeoutError:
+        os.kill(proc.pid, signal.SIGKILL)
+        await waiting
+
+
+async def wait_supervised(proc, waiting, watchdog):
+    # returns (status, rusage, reason of kill or None)
+    if watchdog is None:
+        return (*await asyncio.shield(waiting), None)
+    while True:
+        done, _ = await asyncio.wait({waiting}, timeout=wd.poll_interval)
+        if len(done):
+            return (*waiting.result(), None)
+        reason = watchdog.expired()
+        if reason is not None:
+            await terminate(proc, waiting)
+            return (*waiting.result(), reason)
+
+
+def launch(task):
+    with open(osp.join(task.log_dir, 'simulator_out.txt'), 'w') as out, \
+            open(osp.join(task.log_dir, 'simulator_err.txt'), 'w') as err:
+        proc = subprocess.Popen(task.launch_command(), stdout=out, stderr=err, cwd=task.work_dir)
+    task.pin(proc.pid)
+    return proc
+
+
+async def run_launched(task, slots):
+    loop = asyncio.get_running_loop()
+    # prepare_run goes on in its thread when the job is cancelled
+    preparing = loop.run_in_executor(None, task.prepare_run)
+    try:
+        if not await asyncio.shield(preparing):
+            return None
+        # copying to the local cache would block the event loop
+        await loop.run_in_executor(None, task.stage_cpt)
+        slot = await slots.get() if slots is not None else None
+    except asyncio.CancelledError:
+        # claimed but not launched: free the 'running' marker for a later run
+        if await preparing:
+            await loop.run_in_executor(None, task.release_claim)
+        raise
+    task.cpu_slot = slot
+    start = time.time()
+    exit_code, rusage, killed_reason = None, None, None
+    proc = None
+    waiting = None
+    try:
+        proc = launch(task)
+        waiting = asyncio.ensure_future(wait4(proc.pid))
+        status, rusage, killed_reason = await wait_supervised(proc, waiting, task.watchdog())
+        # reaped here, Popen must not wait for it again
+        proc.returncode = exit_code = os.waitstatus_to_exitcode(status)
+    except asyncio.CancelledError:
+        if waiting is not None:
+            await terminate(proc, waiting)
+            status, rusage = waiting.result()
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        await loop.run_in_executor(None, task.record_run, time.time() - start, rusage, None)
+        await loop.run_in_executor(None, task.finish_run, None)
+        raise
+    except Exception as e:
+        print(e)
+    finally:
+        if slot is not None:
+            slots.put_nowait(slot)
+    await loop.run_in_executor(None, task.record_run, time.time() - start, rusage, exit_code)
+    await loop.run_in_executor(None, task.finish_run, exit_code, killed_reason)
+    return task.workload, task.sub_phase_id
+
+
+async def run_task_async(task, sem, slots=None, gate=None):
+    async with sem:
+        if gate is None or task.dry_run or task.mem_estimate_kb is None:
+            return await run_launched(task, slots)
+        await gate.admit(task.mem_estimate_kb)
+        try:
+            return await run_launched(task, slots)
+        finally:
+            await gate.release(task.mem_estimate_kb)
+
+
+async def run_tasks_async(tasks, max_concurrency, allocator=None, prefetcher=None, gate=None):
+    sem = asyncio.Semaphore(max_concurrency)
+    slots = None
+    if allocator is not None:
+        slots = asyncio.Queue()
+        for slot in allocator.slots:
+            slots.put_nowait(slot)
+    # kill the simulators when the controller is terminated
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    jobs = [asyncio.create_task(run_task_async(task, sem, slots, gate))
+            for task in tasks if task.valid]
+    results = []
+    try:
+        for job in asyncio.as_completed(jobs):
+            res = await job
+            if prefetcher is not None:
+                prefetcher.task_done()
+            if res is not None:
+                print(res)
+                results.append(res)
+    finally:
+        for job in jobs:
+            job.cancel()
+        # let cancelled jobs kill their simulators
+        await asyncio.gather(*jobs, return_exceptions=True)
+    return results
+
+
+def run_tasks(tasks, max_concurrency, allocator=None, prefetcher=None, gate=None):
+    # prefetcher: common.cpt_cache.CptPrefetcher, told of each finished task
+    # gate: AsyncMemoryGate, with mem_estimate_kb of the tasks set
+    return asyncio.run(run_tasks_async(tasks, max_concurrency, allocator, prefetcher, gate))
@@ -0,0 +1,196 @@
+import os
+import os.path as osp
+import glob
+import gzip
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Node-local staging cache of checkpoints.
+# A checkpoint on NFS is copied once into cache_dir, named after a hash of its
+# path, size and mtime, and simulators read the local copy. The cache is
+# shared by every worker on the node: eviction runs under an flock of
+# cache_dir/.lock and removes the least recently staged files until the new
+# one fits in max_bytes. A simulator that has opened an evicted file keeps
+# reading it, since the inode lives until it is closed.
+
+default_cache_dir = '/tmp/cpt_cache'
+default_max_bytes = 200 * 1024**3
+lock_name = '.lock'
+# how long a worker waits for a checkpoint that another one is copying in
+inflight_timeout = 600
+# a partial copy not written for so long is left by a dead process
+stale_tmp_age = 60
+
+
+def cache_key(path: str):
+    st = os.stat(path)
+    info = f'{osp.realpath(path)}:{st.st_size}:{st.st_mtime_ns}'
+    return hashlib.sha1(info.encode()).hexdigest()[:20], st.st_size
+
+
+def replace_cpt_option(option: str, cpt_file: str, local: str):
+    # both `--generic-rv-cpt path` and `--generic-rv-cpt=path` forms
+    if option == cpt_file:
+        return local
+    if option.endswith('=' + cpt_file):
+        return option[:-len(cpt_file)] + local
+    return option
+
+
+def tmp_path(local: str):
+    return f'{local}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def is_stale(tmp: str):
+    try:
+        return time.time() - os.stat(tmp).st_mtime > stale_tmp_age
+    except FileNotFoundError:
+        return True
+
+
+class CptCache:
+    def __init__(self, cache_dir=default_cache_dir, max_bytes=default_max_bytes,
+            decompress=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # keep gzipped checkpoints decompressed, for simulators that read raw ones
+        self.decompress = decompress
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @contextmanager
+    def lock(self):
+        with open(osp.join(self.cache_dir, lock_name), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def local_path(self, path: str):
+        key, size = cache_key(path)
+        # keep the name, simulators tell gzipped checkpoints by the extension
+        name = osp.basename(path)
+        if self.decompress and name.endswith('.gz'):
+            name = name[:-len('.gz')]
+            # the decompressed size is unknown until it is written
+            size *= 4
+        return osp.join(self.cache_dir, f'{key}_{name}'), size
+
+    def cached_files(self):
+        files = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name == lock_name or not e.is_file():
+                    continue
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, e.path))
+        return files
+
+    def evict(self, incoming_bytes):
+        # called with the lock held
+        files = sorted(self.cached_files())
+        used = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if used + incoming_bytes <= self.max_bytes:
+                break
+            if path.endswith('.tmp') and not is_stale(path):
+                # being copied in by another worker
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            used -= size
+
+    def copy_in(self, path: str, local: str):
+        tmp = tmp_path(local)
+        try:
+            if self.decompress and path.endswith('.gz') and not local.endswith('.gz'):
+                with gzip.open(path, 'rb') as src, open(tmp, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 4 * 1024**2)
+            else:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, local)
+        finally:
+            if osp.exists(tmp):
+                os.remove(tmp)
+
+    def wait_inflight(self, local: str):
+        # waits for a copy by another worker or the prefetcher, returns whether it is done
+        deadline = time.time() + inflight_timeout
+        while time.time() < deadline and not all(
+                is_stale(tmp) for tmp in glob.glob(glob.escape(local) + '.*.tmp')):
+            time.sleep(0.5)
+        return osp.isfile(local)
+
+    def stage(self, path: str):
+        # returns the local copy of path, or path itself if it does not fit
+        local, size = self.local_path(path)
+        if self.wait_inflight(local):
+            try:
+                # the mtime of a cached file is the time it was last staged
+                os.utime(local)
+                return local
+            except FileNotFoundError:
+                pass
+        if size > self.max_bytes:
+            return path
+        with self.lock():
+            self.evict(size)
+            # a sparse placeholder reserves the space, so that concurrent stagings evict for it
+            with open(tmp_path(local), 'wb') as f:
+                f.truncate(size)
+        self.copy_in(path, local)
+        return local
+
+    def usage(self):
+        files = self.cached_files()
+        return len(files), sum(size for _, size, _ in files)
+
+
+class CptPrefetcher:
+    # Stages the checkpoints of the next tasks in background threads, so that
+    # a simulator finds its checkpoint local when it is launched.
+    # Tasks are dispatched in list order, so the task that starts next is the
+    # one after those running: stage the first n_running + lookahead ones,
+    # then one more whenever a task finishes.
+    def __init__(self, tasks, lookahead, n_threads=4):
+        self.tasks = [task for task in tasks if task.valid and not task.dry_run
+                and task.cpt_cache is not None and task.cpt_file is not None
+                and not (task.avoid_repeat and osp.isfile(task.marker('completed')))]
+        self.lookahead = lookahead
+        self.executor = ThreadPoolExecutor(n_threads)
+        self.next = 0
+        # tasks of a sweep share checkpoints
+        self.submitted = set()
+
+    def stage(self, task):
+        try:
+            task.cpt_cache.stage(task.cpt_file)
+        except OSError as e:
+            print(f'Failed to prefetch {task.cpt_file}: {e}')
+
+    def advance(self, n):
+        for task in self.tasks[self.next:self.next + n]:
+            if task.cpt_file in self.submitted:
+                continue
+            self.submitted.add(task.cpt_file)
+            self.executor.submit(self.stage, task)
+        self.next = min(self.next + n, len(self.tasks))
+
+    def start(self, n_running):
+        self.advance(n_running + self.lookahead)
+
+    def task_done(self):
+        self.advance(1)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
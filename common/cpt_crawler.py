@@ -0,0 +1,127 @@
+import os
+import os.path as osp
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Checkpoint discovery with os.scandir: is_dir()/is_file() are answered from
+# the cached d_type, so an entry costs no extra stat call. Top-level entries
+# are scanned by a thread pool, which hides NFS round trips.
+# The crawl_* functions return the same TaskSummary as the find_* ones in
+# cpt_searcher.py, except that an empty workload_filter means no filter.
+
+cpt_dir_pattern = re.compile(r'\d+')
+cpt_gz_pattern = re.compile(r'_(\d+)_\.gz')
+
+default_crawler_threads = 32
+
+
+def first_file(cpt_dir: str):
+    with os.scandir(cpt_dir) as it:
+        for entry in it:
+            assert entry.is_file()
+            return entry.path
+    # NEMU has created the dir but not dumped the checkpoint yet
+    return None
+
+
+def sub_cpt_dirs(entry_dir: str):
+    with os.scandir(entry_dir) as it:
+        for entry in it:
+            if cpt_dir_pattern.match(entry.name) and entry.is_dir():
+                yield entry
+
+
+# Each scanner takes one top-level entry and returns (rows, complete),
+# where a row is (workload, phase, point, cpt_file).
+
+def scan_sparse_uniform_entry(entry_dir: str, name: str):
+    rows = []
+    complete = True
+    for cpt in sub_cpt_dirs(entry_dir):
+        cpt_file = first_file(cpt.path)
+        if cpt_file is None:
+            complete = False
+            continue
+        rows.append((name, 0, int(cpt.name), cpt_file))
+    return rows, complete
+
+
+def scan_uniform_entry(entry_dir: str, name: str):
+    rows = []
+    complete = True
+    phase = int(name.split('_')[-1])
+    workload = '_'.join(name.split('_')[:-1])
+    for sub_phase in sub_cpt_dirs(entry_dir):
+        cpt_file = first_file(sub_phase.path)
+        if cpt_file is None:
+            complete = False
+            continue
+        m = cpt_gz_pattern.match(osp.basename(cpt_file))
+        assert m is not None
+        rows.append((workload, phase, phase + int(m.group(1)), cpt_file))
+    return rows, complete
+
+
+def scan_simpoint_entry(entry_dir: str, name: str):
+    segments = name.split('_')
+    inst_count = int(segments[-2])
+    workload = '_'.join(segments[:-2])
+    cpt_dir = osp.join(entry_dir, '0')
+    if not osp.isdir(cpt_dir):
+        return [], False
+    cpt_file = first_file(cpt_dir)
+    if cpt_file is None:
+        return [], False
+    return [(workload, 0, inst_count, cpt_file)], True
+
+
+entry_scanners = {
+        'sparse_uniform': scan_sparse_uniform_entry,
+        'uniform': scan_uniform_entry,
+        'simpoint': scan_simpoint_entry,
+        }
+
+
+def top_level_dirs(d: str):
+    with os.scandir(d) as it:
+        return [(entry.path, entry.name) for entry in it if entry.is_dir()]
+
+
+def crawl_cpts(d: str, kind: str, entry_filter=None, n_threads=default_crawler_threads):
+    scan_entry = entry_scanners[kind]
+    entries = top_level_dirs(d)
+    if entry_filter is not None:
+        entries = [e for e in entries if entry_filter(e[1])]
+
+    TaskSummary = {}
+    with ThreadPoolExecutor(n_threads) as executor:
+        for rows, _ in executor.map(lambda e: scan_entry(*e), entries):
+            for workload, phase, point, cpt_file in rows:
+                if workload not in TaskSummary:
+                    TaskSummary[workload] = {}
+                assert point not in TaskSummary[workload]
+                TaskSummary[workload][point] = cpt_file
+    return TaskSummary
+
+
+def crawl_nemu_sparse_uniform_cpts(d: str, workload_filter=None,
+        n_threads=default_crawler_threads):
+    def entry_filter(workload):
+        return not workload_filter or workload in workload_filter
+    return crawl_cpts(d, 'sparse_uniform', entry_filter, n_threads)
+
+
+def crawl_nemu_uniform_cpts(d: str, workload_filter=None,
+        max_phase_per_workload=20*160, point_size=50*10**6,
+        n_threads=default_crawler_threads):
+    def entry_filter(workload_phase):
+        phase = int(workload_phase.split('_')[-1])
+        if phase > max_phase_per_workload * point_size:
+            return False
+        workload = '_'.join(workload_phase.split('_')[:-1])
+        return not workload_filter or workload in workload_filter
+    return crawl_cpts(d, 'uniform', entry_filter, n_threads)
+
+
+def crawl_nemu_simpoint_cpts(d: str, n_threads=default_crawler_threads):
+    return crawl_cpts(d, 'simpoint', None, n_threads)
@@ -0,0 +1,67 @@
+import os
+import os.path as osp
+import time
+import shutil
+import argparse
+import tempfile
+
+from common.cpt_searcher import find_nemu_uniform_cpts
+from common.cpt_crawler import crawl_nemu_uniform_cpts
+
+# Compare crawl_nemu_uniform_cpts with find_nemu_uniform_cpts on a synthetic
+# uniform checkpoint tree:
+#   python3 -m common.cpt_crawler_bench -n 100000 -d /path/on/nfs
+# Run it on the file server you care about, a local tmpfs hides the stat costs.
+
+point_size = 50*10**6
+sub_phases_per_phase = 10
+phases_per_workload = 100
+
+
+def make_synthetic_tree(d: str, n_cpts: int):
+    n_workloads = max(1, n_cpts // (phases_per_workload * sub_phases_per_phase))
+    count = 0
+    for w in range(n_workloads):
+        for p in range(phases_per_workload):
+            phase = p * sub_phases_per_phase * point_size
+            for s in range(sub_phases_per_phase):
+                if count >= n_cpts:
+                    return count
+                cpt_dir = osp.join(d, f'workload{w}_{phase}', str(s))
+                os.makedirs(cpt_dir)
+                open(osp.join(cpt_dir, f'_{s * point_size}_.gz'), 'w').close()
+                count += 1
+    return count
+
+
+def timed(f, *args, **kwargs):
+    start = time.time()
+    res = f(*args, **kwargs)
+    return res, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-cpts', type=int, action='store', default=100000)
+    parser.add_argument('-j', '--threads', type=int, action='store', default=32)
+    parser.add_argument('-d', '--dir', type=str, action='store',
+            help='where to create the synthetic tree, default to a temp dir')
+    args = parser.parse_args()
+
+    top = tempfile.mkdtemp(dir=args.dir)
+    try:
+        n, t = timed(make_synthetic_tree, top, args.num_cpts)
+        print(f'Created {n} checkpoints under {top} in {t:.2f}s')
+
+        max_phase = phases_per_workload * sub_phases_per_phase
+        old, t_old = timed(find_nemu_uniform_cpts, top, [],
+                max_phase_per_workload=max_phase, point_size=point_size)
+        new, t_new = timed(crawl_nemu_uniform_cpts, top, [],
+                max_phase_per_workload=max_phase, point_size=point_size,
+                n_threads=args.threads)
+        assert old == new
+        print(f'find_nemu_uniform_cpts:  {t_old:.3f}s')
+        print(f'crawl_nemu_uniform_cpts: {t_new:.3f}s ({args.threads} threads)')
+        print(f'speedup: {t_old / t_new:.2f}x')
+    finally:
+        shutil.rmtree(top)
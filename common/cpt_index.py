@@ -0,0 +1,108 @@
+import os
+import os.path as osp
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .cpt_crawler import entry_scanners, default_crawler_threads
+
+# On-disk index of NEMU checkpoint trees, so that launchers do not have to
+# list every workload/phase/sub-phase directory on each start.
+#
+# The index is a SQLite file kept next to the data dir (`<data_dir>.cpt_index.sqlite`).
+# Only top-level entries (workload, workload_phase or simpoint dirs) are
+# stat'ed on a refresh; an entry is rescanned only if its mtime changed.
+# Entries with a checkpoint dir that is not dumped yet are stored with
+# mtime -1, so they are rescanned next time.
+
+fallback_index_dir = osp.expanduser('~/.cache/cpt_index')
+
+
+def index_file_of(d: str):
+    d = osp.abspath(d).rstrip('/')
+    index_file = d + '.cpt_index.sqlite'
+    if os.access(osp.dirname(d), os.W_OK) or os.access(index_file, os.W_OK):
+        return index_file
+    # data dir lives on a read-only mount
+    os.makedirs(fallback_index_dir, exist_ok=True)
+    return osp.join(fallback_index_dir,
+            hashlib.sha1(d.encode()).hexdigest() + '.sqlite')
+
+
+class CptIndex:
+    def __init__(self, d: str, kind: str, index_file=None):
+        assert kind in entry_scanners
+        assert osp.isdir(d)
+        self.data_dir = d
+        self.kind = kind
+        self.scan_entry = entry_scanners[kind]
+        self.index_file = index_file if index_file is not None else index_file_of(d)
+        self.conn = sqlite3.connect(self.index_file, timeout=120)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                    'kind TEXT, name TEXT, mtime_ns INTEGER, PRIMARY KEY (kind, name))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS cpts ('
+                    'kind TEXT, name TEXT, workload TEXT, phase INTEGER, point INTEGER, cpt_file TEXT)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS cpts_by_entry ON cpts (kind, name)')
+
+    def close(self):
+        self.conn.close()
+
+    def refresh(self, n_threads=default_crawler_threads):
+        indexed = dict(self.conn.execute(
+            'SELECT name, mtime_ns FROM entries WHERE kind = ?', (self.kind,)))
+        on_disk = set()
+        changed = []
+        with os.scandir(self.data_dir) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                on_disk.add(entry.name)
+                mtime_ns = entry.stat().st_mtime_ns
+                if indexed.get(entry.name) != mtime_ns:
+                    changed.append((entry.path, entry.name, mtime_ns))
+
+        with ThreadPoolExecutor(n_threads) as executor:
+            scanned = list(executor.map(lambda e: self.scan_entry(e[0], e[1]), changed))
+
+        with self.conn:
+            for (_, name, mtime_ns), (rows, complete) in zip(changed, scanned):
+                self.conn.execute('DELETE FROM cpts WHERE kind = ? AND name = ?',
+                        (self.kind, name))
+                self.conn.executemany('INSERT INTO cpts VALUES (?, ?, ?, ?, ?, ?)',
+                        [(self.kind, name, *row) for row in rows])
+                self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                        (self.kind, name, mtime_ns if complete else -1))
+            for name in set(indexed) - on_disk:
+                self.conn.execute('DELETE FROM cpts WHERE kind = ? AND name = ?', (self.kind, name))
+                self.conn.execute('DELETE FROM entries WHERE kind = ? AND name = ?', (self.kind, name))
+        return len(changed)
+
+    def query(self, workload_filter=None, max_phase=None):
+        TaskSummary = {}
+        rows = self.conn.execute(
+            'SELECT workload, phase, point, cpt_file FROM cpts WHERE kind = ?', (self.kind,))
+        for workload, phase, point, cpt_file in rows:
+            if max_phase is not None and phase > max_phase:
+                continue
+            if workload_filter is not None and len(workload_filter) \
+                    and workload not in workload_filter:
+                continue
+            if workload not in TaskSummary:
+                TaskSummary[workload] = {}
+            assert point not in TaskSummary[workload]
+            TaskSummary[workload][point] = cpt_file
+        return TaskSummary
+
+
+def find_cpts_with_index(d: str, kind: str, workload_filter=None,
+        max_phase_per_workload=20*160, point_size=50*10**6, rescan=True):
+    index = CptIndex(d, kind)
+    if rescan:
+        n = index.refresh()
+        if n:
+            print(f'Rescanned {n} entries of {d}')
+    max_phase = max_phase_per_workload * point_size if kind == 'uniform' else None
+    TaskSummary = index.query(workload_filter, max_phase)
+    index.close()
+    return TaskSummary
@@ -81,3 +81,14 @@ def find_nemu_simpoint_cpts(d: str):
         TaskSummary[workload][int(inst_count)] = cpt_file
     return TaskSummary
 
+
+_cpt_stores = {}
+
+
+def lookup_cpt(workload: str, point: int, kind='simpoint', store_dir=None, build=None):
+    # checkpoint of a workload at a point from the content-addressed store, or None
+    from .cpt_store import CptStore, default_store_dir
+    store_dir = store_dir if store_dir is not None else default_store_dir
+    if store_dir not in _cpt_stores:
+        _cpt_stores[store_dir] = CptStore(store_dir)
+    return _cpt_stores[store_dir].lookup(kind, workload, point, build)
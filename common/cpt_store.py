@@ -0,0 +1,221 @@
+import os
+import os.path as osp
+import errno
+import fcntl
+import shutil
+import sqlite3
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from .cpt_crawler import crawl_cpts, entry_scanners, default_crawler_threads
+
+# Content-addressed store of NEMU checkpoints.
+# A checkpoint is kept once under objects/<ab>/<sha256>, and every batch dir
+# that holds the same bytes gets a hardlink to it (a reflink or a copy across
+# file systems). store.sqlite maps (kind, workload, point, NEMU build) to the
+# object, so "is this checkpoint taken already" is a single primary-key lookup.
+# kind is a kind of common.cpt_crawler: points of simpoint checkpoints are the
+# starts in their dir names, points of uniform ones are exact inst counts.
+# Objects are read-only: a simulator that opens a linked checkpoint for
+# writing fails instead of changing every batch dir that links it.
+
+default_store_dir = '/home51/zyy/expri_results/cpt_store'
+hash_chunk_size = 4 * 1024**2
+object_mode = 0o444
+
+# ioctl of Linux CoW file systems (btrfs, xfs) to share extents of two files
+FICLONE = 0x40049409
+
+
+def file_digest(path: str):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(hash_chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_build_hashes = {}
+
+
+def build_hash(exe: str):
+    # identifies a NEMU build by the content of its binary
+    st = os.stat(exe)
+    key = (osp.realpath(exe), st.st_mtime_ns, st.st_size)
+    if key not in _build_hashes:
+        _build_hashes[key] = file_digest(exe)[:16]
+    return _build_hashes[key]
+
+
+def reflink(src: str, dst: str):
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        if osp.exists(dst):
+            os.remove(dst)
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def replace_with_link(src: str, dst: str):
+    # dst becomes a link (or copy) of src, readers never see a partial file
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    how = link_or_copy(src, tmp)
+    os.replace(tmp, dst)
+    return how
+
+
+class CptStore:
+    def __init__(self, root=default_store_dir):
+        self.root = root
+        self.objects_dir = osp.join(root, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.conn = sqlite3.connect(osp.join(root, 'store.sqlite'), timeout=120)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS objects ('
+                    'digest TEXT PRIMARY KEY, size INTEGER)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS cpts ('
+                    'kind TEXT, workload TEXT, point INTEGER, build TEXT, digest TEXT, name TEXT, '
+                    'PRIMARY KEY (kind, workload, point, build))')
+            # files known to hold an object, so that they are not hashed again
+            self.conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                    'path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT)')
+
+    def close(self):
+        self.conn.close()
+
+    def object_path(self, digest: str):
+        return osp.join(self.objects_dir, digest[:2], digest)
+
+    def known_digest(self, path: str):
+        row = self.conn.execute('SELECT mtime_ns, size, digest FROM files WHERE path = ?',
+                (path,)).fetchone()
+        if row is None:
+            return None
+        st = os.stat(path)
+        if (st.st_mtime_ns, st.st_size) != (row[0], row[1]):
+            return None
+        return row[2]
+
+    def put(self, path: str, digest: str, kind, workload, point, build='', dedup=True):
+        # path: a checkpoint whose sha256 is digest
+        obj = self.object_path(digest)
+        if not osp.exists(obj):
+            os.makedirs(osp.dirname(obj), exist_ok=True)
+            replace_with_link(path, obj)
+        if os.stat(obj).st_mode & 0o777 != object_mode:
+            os.chmod(obj, object_mode)
+        if dedup and not osp.samefile(obj, path):
+            replace_with_link(obj, path)
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO objects VALUES (?, ?)',
+                    (digest, os.stat(obj).st_size))
+            self.conn.execute('INSERT OR REPLACE INTO cpts VALUES (?, ?, ?, ?, ?, ?)',
+                    (kind, workload, point, build, digest, osp.basename(path)))
+            self.record_file(path, digest)
+        return digest
+
+    def record_file(self, path: str, digest: str):
+        st = os.stat(path)
+        self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                (path, st.st_mtime_ns, st.st_size, digest))
+
+    def add(self, path: str, kind, workload, point, build='', dedup=True):
+        path = osp.abspath(path)
+        digest = self.known_digest(path)
+        if digest is None:
+            digest = file_digest(path)
+        return self.put(path, digest, kind, workload, point, build, dedup)
+
+    def add_tree(self, d: str, kind, build='', entry_filter=None,
+            n_threads=default_crawler_threads, dedup=True):
+        # adds every checkpoint under a batch dir, returns the number of them
+        assert kind in entry_scanners
+        summary = crawl_cpts(d, kind, entry_filter, n_threads)
+        rows = [(osp.abspath(f), workload, point)
+                for workload, cpts in summary.items() for point, f in cpts.items()]
+        digests = [self.known_digest(path) for path, _, _ in rows]
+        # hashing is I/O bound, sqlite and links stay in this thread
+        with ThreadPoolExecutor(n_threads) as pool:
+            hashed = pool.map(file_digest, [path for (path, _, _), digest in zip(rows, digests)
+                if digest is None])
+            hashed = iter(list(hashed))
+        for (path, workload, point), digest in zip(rows, digests):
+            if digest is None:
+                digest = next(hashed)
+            self.put(path, digest, kind, workload, point, build, dedup)
+        return len(rows)
+
+    def find(self, kind, workload, point, build=None):
+        # returns (digest, name) of a stored checkpoint or None, any build if build is None
+        query = 'SELECT digest, name FROM cpts WHERE kind = ? AND workload = ? AND point = ?'
+        params = (kind, workload, point)
+        if build is not None:
+            query += ' AND build = ?'
+            params += (build,)
+        row = self.conn.execute(query, params).fetchone()
+        if row is None or not osp.isfile(self.object_path(row[0])):
+            return None
+        return row
+
+    def lookup(self, kind, workload, point, build=None):
+        # returns the object of a checkpoint or None, any build if build is None
+        row = self.find(kind, workload, point, build)
+        return None if row is None else self.object_path(row[0])
+
+    def materialize(self, kind, workload, point, cpt_dir: str, build=None):
+        # links a stored checkpoint into cpt_dir under its original name
+        row = self.find(kind, workload, point, build)
+        if row is None:
+            return None
+        digest, name = row
+        os.makedirs(cpt_dir, exist_ok=True)
+        path = osp.abspath(osp.join(cpt_dir, name))
+        obj = self.object_path(digest)
+        if not osp.exists(path):
+            replace_with_link(obj, path)
+        if osp.samefile(obj, path):
+            # add_tree then knows the digest without hashing it
+            with self.conn:
+                self.record_file(path, digest)
+        return path
+
+    def usage(self):
+        # (number of objects, bytes stored, bytes referenced by batch dirs)
+        n, stored = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+        referenced, = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()
+        return n, stored, referenced
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add checkpoint batch dirs to the checkpoint store')
+    parser.add_argument('dirs', nargs='+', help='batch dirs of NEMU checkpoints')
+    parser.add_argument('-k', '--kind', choices=list(entry_scanners.keys()), required=True)
+    parser.add_argument('-s', '--store', default=default_store_dir)
+    parser.add_argument('-b', '--build', help='NEMU binary that took the checkpoints')
+    parser.add_argument('-j', '--threads', type=int, default=default_crawler_threads)
+    parser.add_argument('--no-dedup', action='store_true',
+            help='only index, do not replace duplicates with links')
+    args = parser.parse_args()
+
+    store = CptStore(args.store)
+    build = build_hash(args.build) if args.build is not None else ''
+    for d in args.dirs:
+        n = store.add_tree(d, args.kind, build, n_threads=args.threads, dedup=not args.no_dedup)
+        print(f'{d}: {n} checkpoints')
+    n, stored, referenced = store.usage()
+    print(f'{n} objects, {stored / 1024**3:.1f} GB stored for {referenced / 1024**3:.1f} GB of checkpoints')
+    store.close()
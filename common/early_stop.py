@@ -0,0 +1,131 @@
+import math
+import os.path as osp
+
+from common.gem5_stats import parse_stats_file, cpi_of_dump, stats_file_of_task
+
+# Adaptive SimPoint batches: points of each workload run in descending weight
+# order, and a workload gets no more points once its weighted CPI is known
+# within a relative error bound.
+#
+# With measured points i and remaining points j of a workload, the true
+# weighted CPI differs from the estimate sum(w_i cpi_i) / sum(w_i) by
+# sum(w_j (cpi_j - estimate)) / W. Taking the remaining CPIs as drawn from the
+# spread s of the measured ones, that error has a standard deviation of
+# s * sqrt(sum(w_j^2)) / W, so heavy points left out dominate the bound, and
+# a workload whose weight sits in a few points converges after those.
+# CPI of a finished task is read by the cpi_reader of its config, and a batch
+# whose config has none is rejected before anything runs.
+
+z_of_confidence = {0.8: 1.282, 0.9: 1.645, 0.95: 1.96, 0.99: 2.576}
+
+
+class WeightedCpiEstimate:
+    def __init__(self, weights: dict):
+        # weights: point -> weight of every point of the workload in the batch
+        self.weights = weights
+        self.total = sum(weights.values())
+        self.cpis = {}
+
+    def add(self, point, cpi):
+        self.cpis[point] = cpi
+
+    def estimate(self):
+        measured = sum(self.weights[p] for p in self.cpis)
+        if measured <= 0:
+            return None
+        return sum(self.weights[p] * cpi for p, cpi in self.cpis.items()) / measured
+
+    def half_width(self, z):
+        n = len(self.cpis)
+        remaining = [w for p, w in self.weights.items() if p not in self.cpis]
+        if not len(remaining):
+            return 0.0
+        if n < 2:
+            return math.inf
+        mean = self.estimate()
+        measured = sum(self.weights[p] for p in self.cpis)
+        var = sum(self.weights[p] * (cpi - mean)**2 for p, cpi in self.cpis.items()) / measured
+        # unbiased for the number of points, not of weights
+        var *= n / (n - 1)
+        return z * math.sqrt(var) * math.sqrt(sum(w * w for w in remaining)) / self.total
+
+    def relative_error(self, z):
+        mean = self.estimate()
+        if mean is None:
+            return math.inf
+        return self.half_width(z) / mean
+
+
+def gem5_task_cpi(task):
+    f = osp.join(task.log_dir, stats_file_of_task)
+    if not osp.isfile(f):
+        return None
+    return cpi_of_dump(parse_stats_file(f))
+
+
+# cpi_reader of a SimulatorTask config -> CPI of a finished task or None
+task_cpi_readers = {
+        'gem5': gem5_task_cpi,
+        }
+
+
+def task_cpi_reader(tasks):
+    # the reader of the configs of tasks, a batch of other simulators never stops early
+    readers = {type(task).__name__: task.cpi_reader for task in tasks}
+    for config, reader in readers.items():
+        assert reader in task_cpi_readers, \
+                f'No CPI reader of {config}, set cpi_reader of the config'
+    assert len(set(readers.values())) <= 1, f'Tasks of several CPI readers: {readers}'
+    return task_cpi_readers[next(iter(readers.values()), 'gem5')]
+
+
+class EarlyStopScheduler:
+    def __init__(self, tasks, simpoint_weights: dict, threshold, confidence=0.95,
+            min_points=3, task_cpi=None):
+        # task_cpi: CPI of a finished task, task_cpi_reader(tasks) if None
+        if task_cpi is None:
+            task_cpi = task_cpi_reader(tasks)
+        self.threshold = threshold
+        self.z = z_of_confidence[confidence]
+        self.min_points = min_points
+        self.task_cpi = task_cpi
+        self.estimates = {}
+        for task in tasks:
+            if task.workload not in self.estimates:
+                self.estimates[task.workload] = WeightedCpiEstimate({})
+            self.estimates[task.workload].weights[task.sub_phase_id] = \
+                    simpoint_weights[task.workload][int(task.sub_phase_id)]
+        for estimate in self.estimates.values():
+            estimate.total = sum(estimate.weights.values())
+        # heaviest points first, across workloads
+        self.pending = sorted(tasks, key=lambda t: self.estimates[t.workload].weights[t.sub_phase_id],
+                reverse=True)
+        self.stopped = set()
+
+    def next_task(self):
+        while len(self.pending):
+            task = self.pending.pop(0)
+            if task.workload not in self.stopped:
+                return task
+        return None
+
+    def task_done(self, task):
+        cpi = self.task_cpi(task)
+        if cpi is None:
+            print(f'No CPI of {task.code_name}')
+            return
+        estimate = self.estimates[task.workload]
+        estimate.add(task.sub_phase_id, cpi)
+        error = estimate.relative_error(self.z)
+        if task.workload not in self.stopped and len(estimate.cpis) >= self.min_points \
+                and error < self.threshold:
+            self.stopped.add(task.workload)
+            skipped = len(estimate.weights) - len(estimate.cpis)
+            if skipped > 0:
+                print(f'{task.workload}: CPI {estimate.estimate():.4f} +- {error:.2%}, '
+                        f'skip {skipped} remaining points')
+
+    def summary(self):
+        # workload -> (weighted CPI, relative error, measured points, points)
+        return {w: (e.estimate(), e.relative_error(self.z), len(e.cpis), len(e.weights))
+                for w, e in self.estimates.items()}
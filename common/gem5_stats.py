@@ -0,0 +1,278 @@
+import os
+import json
+import hashlib
+import os.path as osp
+from multiprocessing import Pool
+
+import numpy as np
+
+from common.task_cost import load_simpoint_weights
+
+# Gathering gem5 stats of a batch into a columnar table:
+#   top_output_dir/task_name/workload/sub_phase/m5out/stats.txt
+# Each stats.txt is parsed line by line and only selected counters of the
+# last complete dump are kept.
+# A manifest (task_name/stats_manifest.json) remembers mtime, size, inode,
+# parsed offset and last dump of every stats.txt, so that a refresh only parses
+# new or modified files, from where the previous parse stopped.
+# A rerun truncates and rewrites stats.txt, possibly to the same or a larger
+# size: the bytes at the head and before the parsed offset are hashed, and a
+# file whose hashed bytes changed is parsed again from the start.
+
+default_counters = [
+        'sim_insts',
+        'sim_ticks',
+        'system.cpu.numCycles',
+        'system.cpu.committedInsts',
+        'system.cpu.ipc',
+        'system.cpu.cpi',
+        ]
+
+stats_file_of_task = osp.join('m5out', 'stats.txt')
+
+begin_marker = '---------- Begin Simulation Statistics'
+end_marker = '---------- End Simulation Statistics'
+
+
+def parse_stats_stream(fp, counters: set, dump=None):
+    # returns (last complete dump, offset right after it, current partial dump)
+    last_dump = None
+    last_offset = None
+    offset = fp.tell()
+    for line in iter(fp.readline, b''):
+        offset += len(line)
+        if line.startswith(b'----------'):
+            if line.startswith(begin_marker.encode()):
+                dump = {}
+            elif line.startswith(end_marker.encode()) and dump is not None:
+                last_dump, last_offset = dump, offset
+                dump = None
+            continue
+        if dump is None:
+            continue
+        space = line.find(b' ')
+        if space < 0:
+            continue
+        name = line[:space].decode()
+        if name in counters:
+            value = line[space:].split(None, 1)[0]
+            try:
+                dump[name] = float(value)
+            except ValueError:
+                # nan, inf, or a distribution bucket
+                dump[name] = float('nan')
+    return last_dump, last_offset, dump
+
+
+def parse_stats_file(f, counters=default_counters):
+    with open(f, 'rb') as fp:
+        last_dump, _, _ = parse_stats_stream(fp, set(counters))
+    return last_dump
+
+
+def cpi_of_dump(dump: dict):
+    # the same fallbacks as StatsTable.cpi, None if the dump has none of them
+    if dump is None:
+        return None
+    cpi = dump.get('system.cpu.cpi', float('nan'))
+    if cpi != cpi and dump.get('system.cpu.ipc'):
+        cpi = 1.0 / dump['system.cpu.ipc']
+    if cpi != cpi and dump.get('system.cpu.committedInsts') and 'system.cpu.numCycles' in dump:
+        cpi = dump['system.cpu.numCycles'] / dump['system.cpu.committedInsts']
+    return None if cpi != cpi else cpi
+
+
+def find_task_dirs(d: str, simpoint_weights=None):
+    # yields (workload, point, task_dir)
+    if simpoint_weights is not None:
+        for workload, points in simpoint_weights.items():
+            for point in points:
+                yield workload, point, osp.join(d, workload, str(point))
+        return
+    with os.scandir(d) as workloads:
+        for workload in workloads:
+            if not workload.is_dir():
+                continue
+            with os.scandir(workload.path) as points:
+                for point in points:
+                    if point.is_dir() and point.name.isdigit():
+                        yield workload.name, int(point.name), point.path
+
+
+def _parse_task(args):
+    # returns (mtime_ns, size, last complete dump, offset right after it) or None
+    f, counters, offset = args
+    try:
+        st = os.stat(f)
+    except FileNotFoundError:
+        return None
+    with open(f, 'rb') as fp:
+        fp.seek(offset)
+        last_dump, last_offset, _ = parse_stats_stream(fp, set(counters))
+    return st.st_mtime_ns, st.st_size, st.st_ino, last_dump, last_offset
+
+
+manifest_name = 'stats_manifest.json'
+# bytes hashed at the head of a stats file and before its parsed offset
+digest_block = 4096
+
+
+def prefix_digest(f, offset):
+    with open(f, 'rb') as fp:
+        head = fp.read(min(digest_block, offset))
+        tail_start = max(0, offset - digest_block)
+        fp.seek(tail_start)
+        tail = fp.read(offset - tail_start)
+    return hashlib.sha1(head + tail).hexdigest()
+
+
+def load_manifest(d: str, counters):
+    f = osp.join(d, manifest_name)
+    if not osp.isfile(f):
+        return {}
+    with open(f) as jf:
+        manifest = json.load(jf)
+    if manifest.get('counters') != list(counters):
+        return {}
+    return manifest['files']
+
+
+def save_manifest(d: str, counters, files: dict):
+    f = osp.join(d, manifest_name)
+    tmp = f'{f}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as jf:
+        json.dump({'counters': list(counters), 'files': files}, jf)
+    os.replace(tmp, f)
+
+
+def stale_files(tasks, manifest: dict):
+    # yields (key, stats file, offset to resume from)
+    for workload, point, task_dir in tasks:
+        key = f'{workload}/{point}'
+        f = osp.join(task_dir, stats_file_of_task)
+        try:
+            st = os.stat(f)
+        except FileNotFoundError:
+            continue
+        entry = manifest.get(key)
+        if entry is None or st.st_size < entry['size'] or st.st_ino != entry.get('ino'):
+            # new, or overwritten by a rerun
+            yield key, f, 0
+        elif st.st_mtime_ns != entry['mtime_ns'] or st.st_size != entry['size']:
+            # appended while gem5 is running, unless a rerun rewrote what was parsed
+            if prefix_digest(f, entry['offset']) != entry.get('digest'):
+                yield key, f, 0
+            else:
+                yield key, f, entry['offset']
+
+
+class StatsTable:
+    def __init__(self, columns: dict):
+        # column name -> np.ndarray, all of the same length
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['workload'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def from_rows(cls, rows, counters):
+        # rows: (workload, point, weight, dump)
+        columns = {
+                'workload': np.array([r[0] for r in rows], dtype=str),
+                'point': np.array([r[1] for r in rows], dtype=np.int64),
+                'weight': np.array([r[2] for r in rows], dtype=np.float64),
+                }
+        for c in counters:
+            columns[c] = np.array([r[3].get(c, np.nan) for r in rows], dtype=np.float64)
+        return cls(columns)
+
+    def save(self, f):
+        np.savez(f, **self.columns)
+
+    @classmethod
+    def load(cls, f):
+        with np.load(f) as data:
+            return cls({k: data[k] for k in data.files})
+
+    def cpi(self):
+        cpi = self.columns.get('system.cpu.cpi')
+        if cpi is None:
+            cpi = np.full(len(self), np.nan)
+        if 'system.cpu.ipc' in self.columns:
+            cpi = np.where(np.isnan(cpi), 1.0 / self.columns['system.cpu.ipc'], cpi)
+        if 'system.cpu.numCycles' in self.columns and 'system.cpu.committedInsts' in self.columns:
+            cpi = np.where(np.isnan(cpi), self.columns['system.cpu.numCycles'] /
+                    self.columns['system.cpu.committedInsts'], cpi)
+        return cpi
+
+    def weighted(self):
+        # workload -> (weighted IPC, weighted CPI, covered weight, n points)
+        # CPI is averaged with the weights, IPC is its reciprocal
+        cpi = self.cpi()
+        valid = ~np.isnan(cpi) & (self['weight'] > 0)
+        workloads, inverse = np.unique(self['workload'], return_inverse=True)
+        w = np.where(valid, self['weight'], 0.0)
+        wsum = np.bincount(inverse, weights=w, minlength=len(workloads))
+        wcpi = np.bincount(inverse, weights=np.where(valid, w * cpi, 0.0),
+                minlength=len(workloads))
+        n = np.bincount(inverse, weights=valid.astype(np.float64), minlength=len(workloads))
+        results = {}
+        for i, workload in enumerate(workloads):
+            if wsum[i] <= 0:
+                results[str(workload)] = (np.nan, np.nan, 0.0, 0)
+                continue
+            weighted_cpi = wcpi[i] / wsum[i]
+            results[str(workload)] = (1.0 / weighted_cpi, weighted_cpi, wsum[i], int(n[i]))
+        return results
+
+
+def collect_stats(d: str, simpoint_weights=None, counters=default_counters, n_procs=16,
+        use_manifest=True):
+    tasks = list(find_task_dirs(d, simpoint_weights))
+    manifest = load_manifest(d, counters) if use_manifest else {}
+
+    stale = list(stale_files(tasks, manifest))
+    if len(stale):
+        with Pool(min(n_procs, len(stale))) as p:
+            parsed = p.map(_parse_task, [(f, counters, offset) for _, f, offset in stale],
+                    chunksize=8)
+    else:
+        parsed = []
+    for (key, f, offset), res in zip(stale, parsed):
+        if res is None:
+            continue
+        mtime_ns, size, ino, dump, last_offset = res
+        if dump is None:
+            # no complete dump after offset yet
+            old = manifest.get(key) if offset > 0 else None
+            dump = old['dump'] if old is not None else None
+            last_offset = offset
+        try:
+            digest = prefix_digest(f, last_offset)
+        except FileNotFoundError:
+            continue
+        manifest[key] = {'mtime_ns': mtime_ns, 'size': size, 'ino': ino,
+                'offset': last_offset, 'digest': digest, 'dump': dump}
+    if use_manifest:
+        save_manifest(d, counters, manifest)
+
+    rows = []
+    for workload, point, _ in tasks:
+        entry = manifest.get(f'{workload}/{point}')
+        if entry is None or entry['dump'] is None:
+            continue
+        weight = 0.0
+        if simpoint_weights is not None:
+            weight = simpoint_weights[workload][point]
+        rows.append((workload, point, weight, entry['dump']))
+    print(f'Parsed {len(stale)} new or modified stats files')
+    return StatsTable.from_rows(rows, counters)
+
+
+def collect_simpoint_stats(d: str, simpoints_file, counters=default_counters, n_procs=16,
+        use_manifest=True):
+    return collect_stats(d, load_simpoint_weights(simpoints_file), counters, n_procs,
+            use_manifest)
@@ -0,0 +1,69 @@
+import re
+
+# Memory-aware admission of simulator tasks.
+# Every task carries a memory estimate: its measured peak RSS from the run
+# history when there is one, otherwise what its config asks for (--mem-size).
+# A task starts only when the estimates of running tasks plus its own fit
+# in the memory that was available when the batch started.
+
+meminfo_file = '/proc/meminfo'
+
+default_task_mem_kb = 8 * 1024**2
+# measured peak RSS varies a bit between runs of the same checkpoint
+rss_margin = 1.1
+# left to the OS, page cache and the launcher itself
+default_headroom_kb = 4 * 1024**2
+
+mem_size_pattern = re.compile(r'(\d+(?:\.\d+)?)\s*([kKmMgGtT]?)i?[bB]?$')
+mem_size_units = {'': 1 / 1024, 'k': 1, 'm': 1024, 'g': 1024**2, 't': 1024**3}
+
+
+def parse_mem_size(s: str):
+    # '8GB' -> kB
+    m = mem_size_pattern.match(str(s).strip())
+    assert m is not None, f'Unrecognized memory size {s}'
+    return int(float(m.group(1)) * mem_size_units[m.group(2).lower()])
+
+
+def mem_available_kb():
+    with open(meminfo_file) as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1])
+    raise OSError(f'No MemAvailable in {meminfo_file}')
+
+
+def estimate_task_mem_kb(task, history=None):
+    if history is not None:
+        rss = history.peak_rss_kb(task.task_name, task.code_name, type(task).__name__)
+        if rss is not None:
+            return int(rss * rss_margin)
+    if '--mem-size' in task.dict_options:
+        return parse_mem_size(task.dict_options['--mem-size'])
+    return default_task_mem_kb
+
+
+class MemoryGate:
+    def __init__(self, budget_kb=None, headroom_kb=default_headroom_kb):
+        if budget_kb is None:
+            budget_kb = mem_available_kb() - headroom_kb
+        self.budget_kb = budget_kb
+        import multiprocessing
+        self.reserved = multiprocessing.Value('q', 0, lock=False)
+        self.cond = multiprocessing.Condition()
+
+    def admit(self, mem_kb):
+        with self.cond:
+            # an idle machine always admits, or a huge task would never start
+            while self.reserved.value > 0 and self.reserved.value + mem_kb > self.budget_kb:
+                self.cond.wait()
+            self.reserved.value += mem_kb
+
+    def release(self, mem_kb):
+        with self.cond:
+            self.reserved.value -= mem_kb
+            self.cond.notify_all()
+
+
+# set in each pool worker by common.simulator_task.init_worker
+worker_gate = None
@@ -0,0 +1,102 @@
+import os
+import os.path as osp
+import json
+import time
+import fcntl
+import platform
+import statistics
+
+# Append-only record of simulator runs, one json object per line:
+#   {"time", "host", "task_name", "config", "workload", "sub_phase", "code_name",
+#    "wall_time", "cpu_time", "max_rss_kb", "exit_code"}
+# Written by SimulatorTask.run, read by schedulers and capacity planning.
+
+history_file = osp.expanduser('~/.config/machine_state/run_history.jsonl')
+
+
+def append_record(record: dict, f=history_file):
+    os.makedirs(osp.dirname(f), exist_ok=True)
+    line = json.dumps(record) + '\n'
+    with open(f, 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        fp.write(line)
+        fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def make_record(task, wall_time, rusage, exit_code):
+    return {
+            'time': time.time(),
+            'host': platform.node(),
+            'task_name': task.task_name,
+            'config': type(task).__name__,
+            'workload': task.workload,
+            'sub_phase': task.sub_phase_id,
+            'code_name': task.code_name,
+            'wall_time': wall_time,
+            'cpu_time': None if rusage is None else rusage.ru_utime + rusage.ru_stime,
+            'max_rss_kb': None if rusage is None else rusage.ru_maxrss,
+            'exit_code': exit_code,
+            }
+
+
+def read_records(f=history_file):
+    if not osp.isfile(f):
+        return
+    with open(f) as fp:
+        for line in fp:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # a writer was killed in the middle of a line
+                continue
+
+
+class RunHistory:
+    # Runs are looked up by task name and code name: a code name alone repeats
+    # across batches of other simulators, configs and SPEC versions.
+    def __init__(self, records):
+        self.by_task = {}
+        for r in records:
+            self.by_task.setdefault((r.get('task_name'), r['code_name']), []).append(r)
+
+    @classmethod
+    def load(cls, f=history_file):
+        return cls(read_records(f))
+
+    def __len__(self):
+        return len(self.by_task)
+
+    def records_of(self, task_name, code_name, config=None, succeeded_only=True):
+        records = self.by_task.get((task_name, code_name), [])
+        if config is not None:
+            records = [r for r in records if r['config'] == config]
+        if succeeded_only:
+            records = [r for r in records if r['exit_code'] == 0]
+        return records
+
+    def median_wall_time(self, task_name, code_name, config=None):
+        records = self.records_of(task_name, code_name, config)
+        if not len(records):
+            return None
+        return statistics.median(r['wall_time'] for r in records)
+
+    def peak_rss_kb(self, task_name, code_name, config=None):
+        # aborted runs count: they may have been killed for using too much memory
+        rss = [r['max_rss_kb'] for r in
+                self.records_of(task_name, code_name, config, succeeded_only=False)
+                if r['max_rss_kb'] is not None]
+        if not len(rss):
+            return None
+        return max(rss)
+
+    def workload_summary(self, config=None):
+        # workload -> (runs, total wall time, max peak rss kb)
+        summary = {}
+        for records in self.by_task.values():
+            for r in records:
+                if config is not None and r['config'] != config:
+                    continue
+                runs, wall, rss = summary.get(r['workload'], (0, 0.0, 0))
+                summary[r['workload']] = (runs + 1, wall + r['wall_time'],
+                        max(rss, r['max_rss_kb'] or 0))
+        return summary
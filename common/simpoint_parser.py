@@ -1,66 +1,82 @@
-# This file is copied from gem5 for parsing simpoint outputs
-import re
+# This file is copied from gem5 for parsing simpoint outputs,
+# with files read in bulk into NumPy arrays
+import os
+import os.path as osp
+from multiprocessing import Pool
+
+import numpy as np
+
+simpoint_dtype = np.dtype([
+    ('interval', np.int64),
+    ('weight', np.float64),
+    ('start', np.int64),
+    ('warmup', np.int64),
+    ])
+
+# a process pool only pays off for a large profile dir
+min_workloads_per_pool = 64
+
+
+class SimpointFormatError(ValueError):
+    pass
+
+
+def read_columns(filename, dtype):
+    # `value index` per line, returns the first column
+    with open(filename) as f:
+        tokens = f.read().split()
+    if len(tokens) % 2 != 0:
+        raise SimpointFormatError(f'unrecognized line in {filename}')
+    try:
+        return np.array(tokens[0::2], dtype=dtype)
+    except ValueError:
+        raise SimpointFormatError(f'unrecognized line in {filename}')
 
 
 # Set up environment for taking SimPoint checkpoints
 # Expecting SimPoint files generated by SimPoint 3.2
-def parse_simpoint_analysis_file(simpoint_filename, weight_filename, interval_length, warmup_length):
-    # print("simpoint analysis file:", simpoint_filename)
-    # print("simpoint weight file:", weight_filename)
-    # print("interval length:", interval_length)
-    # print("warmup length:", warmup_length)
-
+def read_simpoints(simpoint_filename, weight_filename, interval_length, warmup_length):
+    # returns a simpoint_dtype array sorted by start inst
     interval_length = int(interval_length)
     warmup_length = int(warmup_length)
 
     # Simpoint analysis output starts interval counts with 0.
-    simpoints = []
-    simpoint_start_insts = []
-
-    # Read in SimPoint analysis files
-    simpoint_file = open(simpoint_filename)
-    weight_file = open(weight_filename)
-    while True:
-        line = simpoint_file.readline()
-        if not line:
-            break
-        m = re.match("(\d+)\s+(\d+)", line)
-        if m:
-            interval = int(m.group(1))
-        else:
-            fatal('unrecognized line in simpoint file!')
-
-        line = weight_file.readline()
-        if not line:
-            fatal('not enough lines in simpoint weight file!')
-        m = re.match("([0-9\.e\-]+)\s+(\d+)", line)
-        if m:
-            weight = float(m.group(1))
-        else:
-            fatal('unrecognized line in simpoint weight file!')
-
-        if (interval * interval_length - warmup_length > 0):
-            starting_inst_count = \
-                interval * interval_length - warmup_length
-            actual_warmup_length = warmup_length
-        else:
-            # Not enough room for proper warmup
-            # Just starting from the beginning
-            starting_inst_count = 0
-            actual_warmup_length = interval * interval_length
-
-        simpoints.append((interval, weight, starting_inst_count,
-            actual_warmup_length))
+    intervals = read_columns(simpoint_filename, np.int64)
+    weights = read_columns(weight_filename, np.float64)
+    if len(weights) < len(intervals):
+        raise SimpointFormatError(f'not enough lines in {weight_filename}')
+
+    simpoints = np.empty(len(intervals), dtype=simpoint_dtype)
+    simpoints['interval'] = intervals
+    simpoints['weight'] = weights[:len(intervals)]
+    ends = intervals * interval_length
+    # Not enough room for proper warmup: just starting from the beginning
+    room = ends - warmup_length > 0
+    simpoints['start'] = np.where(room, ends - warmup_length, 0)
+    simpoints['warmup'] = np.where(room, warmup_length, ends)
 
     # Sort SimPoints by starting inst count
-    simpoints.sort(key=lambda obj: obj[2])
-    for s in simpoints:
-        interval, weight, starting_inst_count, actual_warmup_length = s
-        # print(str(interval), str(weight), starting_inst_count,
-        #     actual_warmup_length)
-        simpoint_start_insts.append(starting_inst_count)
+    return simpoints[np.argsort(simpoints['start'], kind='stable')]
+
+
+def parse_simpoint_analysis_file(simpoint_filename, weight_filename, interval_length, warmup_length):
+    # [(interval, weight, starting_inst_count, actual_warmup_length)] sorted by start
+    return [tuple(s) for s in
+            read_simpoints(simpoint_filename, weight_filename, interval_length, warmup_length).tolist()]
+
 
-    # print("Total # of simpoints:", len(simpoints))
+def _read_workload(args):
+    workload, d, interval_length, warmup_length = args
+    return workload, read_simpoints(osp.join(d, workload, 'simpoints0'),
+            osp.join(d, workload, 'weights0'), interval_length, warmup_length)
 
-    return simpoints
 
+def read_simpoint_profile(d: str, interval_length, warmup_length, n_procs=16):
+    # simpoint_profile_{ver}/<workload>/{simpoints0, weights0} -> {workload: array}
+    workloads = sorted(w for w in os.listdir(d)
+            if osp.isfile(osp.join(d, w, 'simpoints0')) and osp.isfile(osp.join(d, w, 'weights0')))
+    jobs = [(w, d, interval_length, warmup_length) for w in workloads]
+    if n_procs > 1 and len(jobs) >= min_workloads_per_pool:
+        with Pool(n_procs) as p:
+            return dict(p.map(_read_workload, jobs, chunksize=8))
+    return dict(map(_read_workload, jobs))
@@ -0,0 +1,195 @@
+import os
+import json
+import argparse
+import os.path as osp
+
+import numpy as np
+
+from common.simpoint_parser import read_simpoint_profile
+from common.run_history import RunHistory
+
+# Reduced SimPoint sets, written in the simpoints JSON format
+# (workload -> {start inst: weight}) that CptBatchDescription reads.
+#
+# --cover C: per workload, the cheapest points whose weights add up to C.
+#   With equal costs that is the heaviest points until C is reached, the rule
+#   simpoints06_cover0.5.json was made with.
+# --budget B: across the suite, every workload keeps its heaviest point and
+#   the rest of B buys the points with the most weight, a 0/1 knapsack.
+#
+# The cost of a point is its simulated instructions (warmup + interval), or
+# its measured wall time scaled to instructions when the run history has it.
+
+default_interval_length = 50 * 10**6
+default_warmup_length = 50 * 10**6
+# resolution of the knapsack tables
+coverage_units = 1000
+budget_units = 4000
+
+
+def load_simpoints_json(f):
+    with open(f) as jf:
+        return {w: {int(k): float(v) for k, v in points.items()}
+                for w, points in json.load(jf).items()}
+
+
+def load_simpoint_profile(d: str, interval_length=default_interval_length,
+        warmup_length=default_warmup_length):
+    # simpoint_profile_{ver}/<workload>/{simpoints0, weights0}
+    return {workload: dict(zip(points['start'].tolist(), points['weight'].tolist()))
+            for workload, points in read_simpoint_profile(d, interval_length, warmup_length).items()}
+
+
+def save_simpoints_json(simpoints: dict, f):
+    # heaviest first in each workload, as the hand-made files
+    js = {w: {str(k): v for k, v in sorted(points.items(), key=lambda x: -x[1])}
+            for w, points in simpoints.items()}
+    with open(f, 'w') as jf:
+        json.dump(js, jf, indent=4)
+
+
+def inst_costs(simpoints: dict, interval_length=default_interval_length,
+        warmup_length=default_warmup_length):
+    # restoring from a checkpoint always warms up for warmup_length
+    return {w: {start: interval_length + warmup_length for start in points}
+            for w, points in simpoints.items()}
+
+
+def history_costs(simpoints: dict, history: RunHistory, task_name, config=None, **kwargs):
+    # measured wall time in instruction units, instruction cost where unmeasured
+    costs = inst_costs(simpoints, **kwargs)
+    measured = {}
+    for w, points in simpoints.items():
+        for start in points:
+            t = history.median_wall_time(task_name, f'{w}_{start}', config)
+            if t is not None:
+                measured[(w, start)] = t
+    if not len(measured):
+        return costs
+    inst_per_second = np.median([costs[w][s] / t for (w, s), t in measured.items() if t > 0])
+    for (w, s), t in measured.items():
+        costs[w][s] = t * inst_per_second
+    return costs
+
+
+def min_cost_cover(weights: dict, costs: dict, target):
+    # cheapest points of one workload with total weight >= target
+    points = sorted(weights, key=lambda p: -weights[p])
+    if len(set(costs[p] for p in points)) <= 1:
+        chosen = []
+        covered = 0.0
+        for p in points:
+            if covered >= target:
+                break
+            chosen.append(p)
+            covered += weights[p]
+        return chosen
+    # knapsack over coverage: best[q] is the least cost of covering q units,
+    # where q saturates at the target
+    need = int(np.ceil(min(target, sum(weights.values())) * coverage_units - 1e-9))
+    best = np.full(need + 1, np.inf)
+    best[0] = 0.0
+    take = np.zeros((len(points), need + 1), dtype=bool)
+    for i, p in enumerate(points):
+        q = int(round(weights[p] * coverage_units))
+        src = np.maximum(np.arange(need + 1) - q, 0)
+        # any state at or above need - q reaches need
+        candidate = best[src] + costs[p]
+        better = candidate < best
+        # states are updated from the previous row only
+        take[i] = better
+        best = np.where(better, candidate, best)
+    chosen = []
+    q = need
+    for i in range(len(points) - 1, -1, -1):
+        if q <= 0:
+            break
+        if take[i, q]:
+            chosen.append(points[i])
+            q = max(q - int(round(weights[points[i]] * coverage_units)), 0)
+    return chosen
+
+
+def cover_subset(simpoints: dict, costs: dict, target):
+    return {w: {p: points[p] for p in min_cost_cover(points, costs[w], target)}
+            for w, points in simpoints.items()}
+
+
+def budget_subset(simpoints: dict, costs: dict, budget):
+    # the heaviest point of every workload, then a 0/1 knapsack of weight over the rest
+    chosen = {w: {} for w in simpoints}
+    items = []
+    for w, points in simpoints.items():
+        if not len(points):
+            continue
+        heaviest = max(points, key=lambda p: points[p])
+        chosen[w][heaviest] = points[heaviest]
+        budget -= costs[w][heaviest]
+        items += [(w, p) for p in points if p != heaviest]
+    assert budget >= 0, 'Budget does not cover one point per workload'
+
+    unit = budget / budget_units if budget > 0 else 1.0
+    n_units = int(budget / unit)
+    best = np.zeros(n_units + 1)
+    take = np.zeros((len(items), n_units + 1), dtype=bool)
+    for i, (w, p) in enumerate(items):
+        c = int(np.ceil(costs[w][p] / unit))
+        if c > n_units:
+            continue
+        candidate = best[:n_units + 1 - c] + simpoints[w][p]
+        better = candidate > best[c:]
+        take[i, c:] = better
+        best[c:] = np.where(better, candidate, best[c:])
+    b = int(np.argmax(best))
+    for i in range(len(items) - 1, -1, -1):
+        if take[i, b]:
+            w, p = items[i]
+            chosen[w][p] = simpoints[w][p]
+            b -= int(np.ceil(costs[w][p] / unit))
+    return chosen
+
+
+def report(simpoints: dict, subset: dict, costs: dict):
+    coverage = [sum(subset[w].values()) / sum(points.values())
+            for w, points in simpoints.items() if sum(points.values()) > 0]
+    n = sum(len(points) for points in subset.values())
+    total = sum(len(points) for points in simpoints.values())
+    cost = sum(costs[w][p] for w, points in subset.items() for p in points)
+    full_cost = sum(costs[w][p] for w, points in simpoints.items() for p in points)
+    print(f'{n}/{total} points, cost {cost:.3g} of {full_cost:.3g}, '
+            f'coverage mean {np.mean(coverage):.3f} min {np.min(coverage):.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Make a reduced simpoints JSON')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-j', '--json', help='simpoints JSON to reduce')
+    source.add_argument('-d', '--profile-dir', help='simpoint_profile dir with simpoints0/weights0')
+    goal = parser.add_mutually_exclusive_group(required=True)
+    goal.add_argument('--cover', type=float, help='weight to cover in each workload')
+    goal.add_argument('--budget', type=float, help='simulated instructions of the whole suite')
+    parser.add_argument('--interval', type=int, default=default_interval_length)
+    parser.add_argument('--warmup', type=int, default=default_warmup_length)
+    parser.add_argument('--history', metavar='TASK_NAME',
+            help='cost points by their measured wall time in the runs of this batch, '
+            'e.g. test_new_wrapper17/FullWindowO3Config')
+    parser.add_argument('--config', help='config name of the runs in the history')
+    parser.add_argument('-o', '--output', required=True)
+    args = parser.parse_args()
+
+    if args.json is not None:
+        simpoints = load_simpoints_json(args.json)
+    else:
+        simpoints = load_simpoint_profile(args.profile_dir, args.interval, args.warmup)
+    lengths = {'interval_length': args.interval, 'warmup_length': args.warmup}
+    if args.history is not None:
+        costs = history_costs(simpoints, RunHistory.load(), args.history, args.config, **lengths)
+    else:
+        costs = inst_costs(simpoints, **lengths)
+
+    if args.cover is not None:
+        subset = cover_subset(simpoints, costs, args.cover)
+    else:
+        subset = budget_subset(simpoints, costs, args.budget)
+    report(simpoints, subset, costs)
+    save_simpoints_json(subset, args.output)
@@ -1,11 +1,22 @@
-import sh
 import os
 import os.path as osp
+import time
+import subprocess
 from pprint import pprint
 import hashlib
 
+from common import run_history
+from common import slot_allocator
+from common import mem_admission
+from common.cpt_cache import replace_cpt_option
+from common.task_claim import TaskClaim
+from common.watchdog import ProgressWatchdog, wait_with_watchdog
+
 
 class SimulatorTask:
+    # key of common.early_stop.task_cpi_readers, None if CPI is not read back
+    cpi_reader = None
+
     def __init__(
             self, exe: str, top_data_dir: str,
             task_name: str, workload: str, sub_phase: int,
@@ -37,6 +48,18 @@ class SimulatorTask:
         self.avoid_repeat = avoid_repeat
         self.cpt_file = None
         self.valid = True
+        self.history_file = run_history.history_file
+        # common.slot_allocator.CpuSlot the simulator is pinned to
+        self.cpu_slot = None
+        # checked by common.mem_admission.MemoryGate before launching
+        self.mem_estimate_kb = None
+        # seconds, killed and marked 'timeout' when exceeded
+        self.timeout = None
+        self.stall_timeout = None
+        # common.cpt_cache.CptCache, cpt_file is read from its local copy
+        self.cpt_cache = None
+        # common.task_claim.TaskClaim on the 'running' marker while running
+        self.claim = None
 
     def __hash__(self):
         info = f"{self.code_name}"
@@ -84,7 +107,18 @@ class SimulatorTask:
             assert not osp.isfile(d)
             os.makedirs(d)
 
-    def run(self):
+    def marker(self, name):
+        return osp.join(self.log_dir, name)
+
+    def touch_marker(self, name):
+        open(self.marker(name), 'a').close()
+
+    def remove_marker(self, name):
+        if osp.isfile(self.marker(name)):
+            os.remove(self.marker(name))
+
+    def prepare_run(self):
+        # returns whether the simulator should be launched
         assert self.work_dir is not None
         assert self.log_dir is not None
 
@@ -92,46 +126,140 @@ class SimulatorTask:
         print(self)
         # print('log_dir: ', self.log_dir)
         if self.dry_run:
-            return
+            return False
         self.check_and_makedir(self.log_dir)
         self.check_and_makedir(self.work_dir)
 
-        os.chdir(self.work_dir)
-
-        cmd = sh.Command(self.exe)
+        if self.avoid_repeat and osp.isfile(self.marker('completed')):
+            print(f'{self.workload}_{self.sub_phase_id} has completed')
+            return False
 
-        if self.avoid_repeat and osp.isfile(osp.join(self.log_dir, 'completed')):
+        # the 'running' marker, taken atomically by one launcher
+        self.claim = TaskClaim(self.marker('running'))
+        if not self.avoid_repeat:
+            self.claim.force()
+        elif not self.claim.acquire():
+            print(f'{self.workload}_{self.sub_phase_id} is running on {self.claim.holder()}')
+            self.claim = None
+            return False
+        elif osp.isfile(self.marker('completed')):
+            # completed by the previous holder between the check and the claim
+            self.release_claim()
             print(f'{self.workload}_{self.sub_phase_id} has completed')
+            return False
+
+        self.remove_marker('aborted')
+        self.remove_marker('timeout')
+        self.remove_marker('completed')
+        return True
+
+    def release_claim(self):
+        if self.claim is None:
+            self.remove_marker('running')
+            return
+        self.claim.release()
+        self.claim = None
+
+    def stage_cpt(self):
+        # point the options at a node-local copy of cpt_file
+        if self.cpt_cache is None or self.cpt_file is None:
             return
-        if self.avoid_repeat and osp.isfile(osp.join(self.log_dir, 'running')):
-            print(f'{self.workload}_{self.sub_phase_id} is running')
+        try:
+            local = self.cpt_cache.stage(self.cpt_file)
+        except OSError as e:
+            print(f'Failed to stage {self.cpt_file}: {e}')
             return
+        self.final_options = [replace_cpt_option(o, self.cpt_file, local)
+                for o in self.final_options]
+
+    def watchdog(self):
+        if self.timeout is None and self.stall_timeout is None:
+            return None
+        return ProgressWatchdog(osp.join(self.log_dir, 'simulator_out.txt'),
+                self.timeout, self.stall_timeout)
 
-        sh.rm(['-f', osp.join(self.log_dir, 'aborted')])
-        sh.rm(['-f', osp.join(self.log_dir, 'completed')])
+    def finish_run(self, exit_code, killed_reason=None):
+        if killed_reason is not None:
+            print(f'{self.code_name} {killed_reason}, killed')
+            self.touch_marker('timeout')
+        elif exit_code != 0:
+            print(f'{self.code_name} exited with {exit_code}')
+            self.touch_marker('aborted')
+        else:
+            self.touch_marker('completed')
+        # after the result marker, so that the next claimer sees it
+        self.release_claim()
 
-        sh.touch(osp.join(self.log_dir, 'running'))
+    def run(self):
+        if not self.prepare_run():
+            return
+        self.stage_cpt()
+        os.chdir(self.work_dir)
+
+        exit_code, rusage, killed_reason = None, None, None
+        start = time.time()
         try:
-            cmd(
-                _out=osp.join(self.log_dir, 'simulator_out.txt'),
-                _err=osp.join(self.log_dir, 'simulator_err.txt'),
-                *self.final_options
-            )
+            # wait4 gives the rusage of this very child, which sh cannot
+            with open(osp.join(self.log_dir, 'simulator_out.txt'), 'w') as out, \
+                    open(osp.join(self.log_dir, 'simulator_err.txt'), 'w') as err:
+                proc = subprocess.Popen(self.launch_command(), stdout=out, stderr=err)
+                self.pin(proc.pid)
+                watchdog = self.watchdog()
+                if watchdog is None:
+                    _, status, rusage = os.wait4(proc.pid, 0)
+                else:
+                    status, rusage, killed_reason = wait_with_watchdog(proc.pid, watchdog)
+                proc.returncode = exit_code = os.waitstatus_to_exitcode(status)
         except Exception as e:
             print(e)
-            if osp.isfile(osp.join(self.log_dir, 'running')):
-                sh.rm(osp.join(self.log_dir, 'running'))
-            sh.touch(osp.join(self.log_dir, 'aborted'))
+        self.record_run(time.time() - start, rusage, exit_code)
+        self.finish_run(exit_code, killed_reason)
+
+    def pin(self, pid):
+        # numactl of launch_command pins the simulator, otherwise pin it once spawned:
+        # preexec_fn is unsafe with threads running, such as the claim heartbeat
+        if self.cpu_slot is None or len(self.cpu_slot.command_prefix()):
             return
-        if osp.isfile(osp.join(self.log_dir, 'running')):
-            sh.rm(osp.join(self.log_dir, 'running'))
-        sh.touch(osp.join(self.log_dir, 'completed'))
-        return
+        try:
+            self.cpu_slot.bind(pid)
+        except OSError as e:
+            print(f'Failed to pin {self.code_name}: {e}')
+
+    def launch_command(self):
+        if self.cpu_slot is None:
+            return [self.exe] + self.final_options
+        return self.cpu_slot.command_prefix() + [self.exe] + self.final_options
+
+    def record_run(self, wall_time, rusage, exit_code):
+        if self.history_file is None:
+            return
+        try:
+            run_history.append_record(
+                    run_history.make_record(self, wall_time, rusage, exit_code),
+                    self.history_file)
+        except OSError as e:
+            print(f'Failed to record run history: {e}')
+
+
+def init_worker(allocator=None, gate=None):
+    if allocator is not None:
+        slot_allocator._init_pinned_worker(allocator)
+    mem_admission.worker_gate = gate
 
 
 def task_wrapper(task: SimulatorTask):
     if task.valid:
-        task.run()
+        if task.cpu_slot is None:
+            task.cpu_slot = slot_allocator.worker_slot
+        gate = mem_admission.worker_gate
+        if gate is None or task.dry_run or task.mem_estimate_kb is None:
+            task.run()
+        else:
+            gate.admit(task.mem_estimate_kb)
+            try:
+                task.run()
+            finally:
+                gate.release(task.mem_estimate_kb)
         return task.workload, task.sub_phase_id
     else:
         return None
@@ -0,0 +1,135 @@
+import os
+import glob
+import queue
+import shutil
+import os.path as osp
+
+# Exclusive CPU slots for simulator processes.
+# A slot is a set of cpus inside one NUMA node. Free slots live in a
+# multiprocessing queue, so acquiring blocks instead of spinning and works
+# across processes.
+
+sys_node_dir = '/sys/devices/system/node'
+
+
+def parse_cpulist(s: str):
+    # '0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = []
+    for part in s.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus += list(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    ranges = []
+    for cpu in sorted(cpus):
+        if len(ranges) and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(lo) if lo == hi else f'{lo}-{hi}' for lo, hi in ranges)
+
+
+def read_topology(node_dir=sys_node_dir):
+    # returns [(node, [cpus])], restricted to cpus this process may run on
+    allowed = os.sched_getaffinity(0)
+    topology = []
+    for f in sorted(glob.glob(osp.join(node_dir, 'node*', 'cpulist')),
+            key=lambda f: int(osp.basename(osp.dirname(f))[4:])):
+        node = int(osp.basename(osp.dirname(f))[4:])
+        with open(f) as fp:
+            cpus = [c for c in parse_cpulist(fp.read()) if c in allowed]
+        if len(cpus):
+            topology.append((node, cpus))
+    if not len(topology):
+        # no NUMA info exposed, e.g. in a container
+        topology = [(None, sorted(allowed))]
+    return topology
+
+
+class CpuSlot:
+    def __init__(self, node, cpus):
+        self.node = node
+        self.cpus = cpus
+
+    def __repr__(self):
+        return f'CpuSlot(node={self.node}, cpus={format_cpulist(self.cpus)})'
+
+    def numactl_options(self):
+        options = ['-C', format_cpulist(self.cpus)]
+        if self.node is not None:
+            options += ['-m', str(self.node)]
+        return options
+
+    def command_prefix(self):
+        # numactl also binds memory to the node; without it, only cpus are pinned
+        if shutil.which('numactl') is None:
+            return []
+        return ['numactl'] + self.numactl_options()
+
+    def bind(self, pid=0):
+        os.sched_setaffinity(pid, self.cpus)
+
+
+def make_slots(cores_per_slot=1, topology=None, max_slots=None):
+    if topology is None:
+        topology = read_topology()
+    per_node = []
+    for node, cpus in topology:
+        per_node.append([CpuSlot(node, cpus[i:i + cores_per_slot])
+            for i in range(0, len(cpus) - cores_per_slot + 1, cores_per_slot)])
+    # interleave nodes, so that a half-full machine uses all memory controllers
+    slots = []
+    for i in range(max((len(s) for s in per_node), default=0)):
+        for node_slots in per_node:
+            if i < len(node_slots):
+                slots.append(node_slots[i])
+    if max_slots is not None:
+        slots = slots[:max_slots]
+    return slots
+
+
+class SlotAllocator:
+    def __init__(self, cores_per_slot=1, max_slots=None, topology=None):
+        self.slots = make_slots(cores_per_slot, topology, max_slots)
+        assert len(self.slots), f'No slot of {cores_per_slot} cores on this machine'
+        import multiprocessing
+        self.free = multiprocessing.Queue()
+        for slot in self.slots:
+            self.free.put(slot)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def acquire(self, block=True, timeout=None):
+        try:
+            return self.free.get(block, timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot: CpuSlot):
+        self.free.put(slot)
+
+
+# A pool worker holds one slot for its whole life and lends it to every task it runs.
+worker_slot = None
+
+
+def _init_pinned_worker(allocator: SlotAllocator):
+    global worker_slot
+    # more workers than slots: the rest run unpinned
+    worker_slot = allocator.acquire(timeout=1)
+
+
+def pinned_pool(n_workers, cores_per_slot=1):
+    allocator = SlotAllocator(cores_per_slot)
+    if n_workers > len(allocator):
+        print(f'{n_workers} workers but only {len(allocator)} slots, some run unpinned')
+    from multiprocessing import Pool
+    return Pool(n_workers, initializer=_init_pinned_worker, initargs=(allocator,))
@@ -0,0 +1,119 @@
+import os
+import os.path as osp
+import json
+import time
+import platform
+import threading
+
+# Claiming a task in an output tree shared by several launchers and hosts.
+# The claim is the task's 'running' marker, created with O_CREAT|O_EXCL, so
+# only one launcher can take it. It records the owner host and pid, and the
+# owner touches it every heartbeat_interval while the simulator runs.
+# A claim whose mtime is older than the lease was left by a crashed launcher:
+# it is renamed away (only one reclaimer can win the rename) and claimed again.
+
+default_lease = 600
+heartbeat_interval = 60
+
+
+def owner_info():
+    return {'host': platform.node(), 'pid': os.getpid(), 'since': time.time()}
+
+
+def read_claim(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # a marker of an older launcher, or being written
+        return None
+
+
+def claim_age(path: str):
+    return time.time() - os.stat(path).st_mtime
+
+
+class TaskClaim:
+    def __init__(self, path: str, lease=default_lease):
+        self.path = path
+        self.lease = lease
+        self.owner = owner_info()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def try_create(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.owner, f)
+        return True
+
+    def break_stale(self):
+        # returns whether the claim may be free now
+        try:
+            age = claim_age(self.path)
+        except FileNotFoundError:
+            return True
+        if age <= self.lease:
+            return False
+        stale = f'{self.path}.stale.{self.owner["host"]}.{self.owner["pid"]}'
+        try:
+            os.rename(self.path, stale)
+        except FileNotFoundError:
+            # reclaimed by another launcher
+            return True
+        if claim_age(stale) <= self.lease:
+            # another launcher reclaimed it between the stat and the rename
+            try:
+                os.link(stale, self.path)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        print(f'Reclaim {self.path} of {read_claim(stale)}, idle for {int(age)}s')
+        os.remove(stale)
+        return True
+
+    def acquire(self):
+        if self.try_create() or (self.break_stale() and self.try_create()):
+            self.start_heartbeat()
+            return True
+        return False
+
+    def force(self):
+        # claims whether or not someone else holds it
+        tmp = f'{self.path}.{self.owner["pid"]}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.owner, f)
+        os.replace(tmp, self.path)
+        self.start_heartbeat()
+
+    def holder(self):
+        return read_claim(self.path)
+
+    def is_mine(self):
+        holder = self.holder()
+        return holder is not None and (holder['host'], holder['pid']) == \
+                (self.owner['host'], self.owner['pid'])
+
+    def start_heartbeat(self):
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+        self.thread.start()
+
+    def beat(self):
+        while not self.stopped.wait(heartbeat_interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                print(f'Lost the claim {self.path}')
+                return
+
+    def release(self):
+        self.stopped.set()
+        if self.is_mine():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
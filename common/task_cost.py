@@ -0,0 +1,91 @@
+import json
+import statistics
+import os.path as osp
+
+# Relative runtime estimates of simulator tasks, used to dispatch long tasks first.
+# Costs are only compared with each other, so their unit does not matter.
+
+inst_count_file = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))),
+        'benchmark_list', 'spec2017rate_inst_count.txt')
+
+
+def load_inst_counts(f=inst_count_file):
+    # format: `benchmark trillion_insts` per line
+    inst_counts = {}
+    with open(f) as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            benchmark, insts = line.split()
+            inst_counts[benchmark] = float(insts)
+    return inst_counts
+
+
+def load_simpoint_weights(simpoints_file):
+    with open(simpoints_file) as jf:
+        simpoints = json.load(jf)
+    return {workload: {int(k): float(w) for k, w in points.items()}
+            for workload, points in simpoints.items()}
+
+
+def benchmark_of(workload: str, known):
+    # x264_pass1 -> x264, gcc_166 -> gcc
+    segments = workload.split('_')
+    for i in range(len(segments), 0, -1):
+        prefix = '_'.join(segments[:i])
+        if prefix in known:
+            return prefix
+    return None
+
+
+class TaskCostEstimator:
+    def __init__(self, inst_counts=None, simpoint_weights=None, history=None):
+        self.inst_counts = inst_counts if inst_counts is not None else load_inst_counts()
+        self.simpoint_weights = simpoint_weights if simpoint_weights is not None else {}
+        # common.run_history.RunHistory, measured wall time beats any guess
+        self.history = history
+        if len(self.inst_counts):
+            self.default_cost = sum(self.inst_counts.values()) / len(self.inst_counts)
+        else:
+            self.default_cost = 1.0
+        # seconds per unit of instruction-count cost, fitted from history
+        self.seconds_per_cost = 1.0
+
+    def weight_of(self, task):
+        return self.simpoint_weights.get(task.workload, {}).get(int(task.sub_phase_id), 0.0)
+
+    def measured(self, task):
+        if self.history is None:
+            return None
+        return self.history.median_wall_time(task.task_name, task.code_name, type(task).__name__)
+
+    def guessed(self, task):
+        benchmark = benchmark_of(task.workload, self.inst_counts)
+        if benchmark is None:
+            return self.default_cost
+        return self.inst_counts[benchmark]
+
+    def fit(self, tasks):
+        # put guesses on the same scale as measured wall times
+        ratios = []
+        for task in tasks:
+            m = self.measured(task)
+            if m is not None:
+                ratios.append(m / self.guessed(task))
+        if len(ratios):
+            self.seconds_per_cost = statistics.median(ratios)
+
+    def estimate(self, task):
+        m = self.measured(task)
+        if m is not None:
+            return m
+        return self.guessed(task) * self.seconds_per_cost
+
+    def sort_key(self, task):
+        # heavier simpoints first among tasks of the same cost,
+        # so that partial results are the most useful ones
+        return self.estimate(task), self.weight_of(task)
+
+    def longest_first(self, tasks):
+        self.fit(tasks)
+        return sorted(tasks, key=self.sort_key, reverse=True)
@@ -0,0 +1,97 @@
+import os
+import re
+import time
+import signal
+import select
+
+# Watchdog of a running simulator: wall-clock limit, plus a progress check
+# that tails simulator_out.txt for instruction/cycle counters.
+# A simulator whose counters have not grown for stall_timeout seconds is
+# considered livelocked. If a simulator prints no counter at all, growth of
+# its output counts as progress.
+
+# emu: `instrCnt = 1000, cycleCnt = 2000`, NEMU/gem5: `... instructions: 1000`
+progress_pattern = re.compile(
+        rb'(?:instrCnt|cycleCnt|instructions?|insts|cycles?|sim_insts|numCycles)\s*[=:]?\s*(\d+)',
+        re.IGNORECASE)
+
+poll_interval = 10
+kill_grace_period = 10
+# only the tail of what was written since the last poll is searched
+max_tail_bytes = 64 * 1024
+
+
+class ProgressWatchdog:
+    def __init__(self, out_file, timeout=None, stall_timeout=None, pattern=progress_pattern):
+        self.out_file = out_file
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.pattern = pattern
+        self.start = time.time()
+        self.last_progress = self.start
+        self.offset = 0
+        self.counter = None
+
+    def progressed(self):
+        try:
+            size = os.path.getsize(self.out_file)
+        except OSError:
+            return False
+        if size <= self.offset:
+            return False
+        with open(self.out_file, 'rb') as f:
+            f.seek(max(self.offset, size - max_tail_bytes))
+            tail = f.read(size - self.offset)
+        self.offset = size
+        values = [int(v) for v in self.pattern.findall(tail)]
+        if not len(values):
+            return self.counter is None
+        counter = max(values)
+        if self.counter is None or counter > self.counter:
+            self.counter = counter
+            return True
+        return False
+
+    def expired(self):
+        # returns the reason to kill the simulator, or None
+        now = time.time()
+        if self.timeout is not None and now - self.start > self.timeout:
+            return f'exceeded {self.timeout}s'
+        if self.stall_timeout is None:
+            return None
+        if self.progressed():
+            self.last_progress = now
+        elif now - self.last_progress > self.stall_timeout:
+            return f'made no progress for {self.stall_timeout}s'
+        return None
+
+
+def sleep_until_exit(pid, seconds):
+    # wakes up as soon as the process exits where pidfd is supported
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        time.sleep(seconds)
+        return
+    try:
+        select.select([fd], [], [], seconds)
+    finally:
+        os.close(fd)
+
+
+def wait_with_watchdog(pid, watchdog: ProgressWatchdog):
+    # os.wait4 with a watchdog, returns (status, rusage, reason of kill or None)
+    reason = None
+    killed_at = None
+    while True:
+        wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+        if wpid == pid:
+            return status, rusage, reason
+        if reason is None:
+            reason = watchdog.expired()
+            if reason is not None:
+                os.kill(pid, signal.SIGTERM)
+                killed_at = time.time()
+        elif time.time() - killed_at > kill_grace_period:
+            os.kill(pid, signal.SIGKILL)
+        sleep_until_exit(pid, 1 if reason is not None else poll_interval)
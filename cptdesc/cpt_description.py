@@ -1,13 +1,32 @@
+import os
+import sys
 import argparse
 import json
 import random
-from multiprocessing import Pool
+import pickle
+import sqlite3
+import hashlib
+import platform
+import os.path as osp
 
 import load_balance as lb
+from load_balance.partition import is_local_task
 from common import task_blacklist
 from common import *
 from common.task_tree import task_tree_to_batch_task
-from common.simulator_task import task_wrapper
+from common.simulator_task import task_wrapper, init_worker
+from common.task_cost import TaskCostEstimator, load_simpoint_weights
+from common.run_history import RunHistory
+from common.mem_admission import MemoryGate, estimate_task_mem_kb, parse_mem_size
+from common.cpt_cache import CptCache, CptPrefetcher
+
+# multiprocessing, asyncio and the coordinator are imported where they are used,
+# so that a dry run or a run of a cached plan starts quickly
+
+plan_cache_dir = osp.expanduser('~/.cache/batch_plans')
+# paths of the launchers, part of the plan key
+local_config_file = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))),
+        'common', 'local_config.py')
 
 class CptBatchDescription:
     def __init__(self, data_dir, exe, top_output_dir, ver,
@@ -15,6 +34,7 @@ class CptBatchDescription:
             simpoints_file=None,
             is_uniform=True,
             is_sparse_uniform=False,
+            use_cpt_index=True,
             ):
 
         self.task_whitelist = []
@@ -26,6 +46,7 @@ class CptBatchDescription:
 
         self.is_uniform = is_uniform
         self.is_sparse_uniform = is_sparse_uniform
+        self.use_cpt_index = use_cpt_index
 
         self.is_simpoint = is_simpoint
         self.simpoints_file = simpoints_file
@@ -44,6 +65,51 @@ class CptBatchDescription:
         self.parser.add_argument('-T', '--task', action='store')
         self.parser.add_argument('-W', '--workload', action='store', nargs='+')
         self.parser.add_argument('-D', '--dry-run', action='store_true')
+        self.parser.add_argument('-S', '--schedule', action='store',
+                choices=['random', 'ljf'], default='random',
+                help='dispatch order of tasks, ljf: longest job first')
+        self.parser.add_argument('-P', '--pin', action='store_true',
+                help='pin each simulator to its own core and NUMA node')
+        self.parser.add_argument('-M', '--mem-aware', action='store_true',
+                help='start a task only when available memory covers its estimate')
+        self.parser.add_argument('-E', '--engine', action='store',
+                choices=['pool', 'asyncio'], default='pool',
+                help='asyncio: supervise all simulators from this process')
+        self.parser.add_argument('--timeout', action='store', type=float,
+                help='wall-clock limit of each task in seconds')
+        self.parser.add_argument('--stall-timeout', action='store', type=float,
+                help='kill a task whose instruction/cycle counters stop growing for so long')
+        self.parser.add_argument('--cpt-cache', action='store',
+                help='node-local dir to stage checkpoints in before launching')
+        self.parser.add_argument('--cpt-cache-size', action='store', default='200GB',
+                help='size cap of the checkpoint cache, least recently staged ones are evicted')
+        self.parser.add_argument('--prefetch', action='store', type=int, default=0,
+                help='stage checkpoints of this many tasks ahead of those running (needs --cpt-cache)')
+        self.parser.add_argument('--prefetch-threads', action='store', type=int, default=4)
+        self.parser.add_argument('--decompress', action='store_true',
+                help='keep gzipped checkpoints decompressed in the cache')
+        self.parser.add_argument('--serve', action='store', nargs='?', const='',
+                help='hand tasks out to workers on all hosts from here, [host]:port to listen on, '
+                '127.0.0.1 unless a host is given')
+        self.parser.add_argument('--coordinator', action='store',
+                help='host:port of a --serve launcher to pull tasks from, '
+                'with the same launcher and filters as there')
+        self.parser.add_argument('--authkey', action='store',
+                help='key of the coordinator, instead of the private key file in the home dir')
+        self.parser.add_argument('--early-stop', action='store', type=float,
+                help='stop launching points of a workload once its weighted CPI is known '
+                'within this relative error (simpoint batches of a config with a cpi_reader, such as gem5)')
+        self.parser.add_argument('--confidence', action='store', type=float, default=0.95,
+                choices=[0.8, 0.9, 0.95, 0.99])
+        self.parser.add_argument('--min-points', action='store', type=int, default=3,
+                help='points of a workload to run before it may stop early')
+        self.parser.add_argument('--replan', action='store_true',
+                help='find checkpoints and build tasks again instead of loading the cached plan')
+        self.parser.add_argument('--sweep', action='store', nargs='+',
+                help='configs to run in one batch, tasks of a checkpoint run together')
+        self.parser.add_argument('--grid', action='store', nargs='+',
+                help='param=v1,v2 ... crossed with the configs, '
+                'param is window_size or a simulator option such as dq-groups')
 
         self.workload_filter = []
 
@@ -51,6 +117,7 @@ class CptBatchDescription:
         self.task_blacklist = [f.replace('/', '_') for f in task_blacklist[ver]]
 
         self.args = None
+        self.cpt_cache = None
 
     def parse_args(self):
         self.args = self.parser.parse_args()
@@ -58,15 +125,8 @@ class CptBatchDescription:
 
     def set_conf(self, Conf, task_name):
         self.task_name = task_name
-        if self.is_simpoint:
-            assert not self.is_uniform
-            self.task_tree = find_nemu_simpoint_cpts(self.data_dir)
-        else:
-            assert self.is_uniform
-            if self.is_sparse_uniform:
-                self.task_tree = find_nemu_sparse_uniform_cpts(self.data_dir, self.workload_filter)
-            else:
-                self.task_tree = find_nemu_uniform_cpts(self.data_dir, self.workload_filter)
+        self._conf = Conf
+        self.find_cpts()
 
         self._tasks = task_tree_to_batch_task(Conf,
                 self.task_tree,
@@ -74,6 +134,50 @@ class CptBatchDescription:
                 self.top_output_dir,
                 self.task_name)
 
+    def set_confs(self, Confs, task_name):
+        # a sweep: tasks of every config over the same checkpoints, in task_name/<config>
+        self.task_name = task_name
+        self._conf = Confs
+        self.find_cpts()
+
+        self._tasks = []
+        for Conf in Confs:
+            self._tasks += task_tree_to_batch_task(Conf,
+                    self.task_tree,
+                    self.exe,
+                    self.top_output_dir,
+                    f'{task_name}/{Conf.__name__}')
+
+    def find_cpts(self):
+        if self.use_cpt_index:
+            self.task_tree = self.find_cpts_with_index()
+        else:
+            self.task_tree = self.crawl_cpts()
+
+    def cpt_kind(self):
+        if self.is_simpoint:
+            assert not self.is_uniform
+            return 'simpoint'
+        assert self.is_uniform
+        return 'sparse_uniform' if self.is_sparse_uniform else 'uniform'
+
+    def crawl_cpts(self):
+        kind = self.cpt_kind()
+        if kind == 'simpoint':
+            return crawl_nemu_simpoint_cpts(self.data_dir)
+        elif kind == 'sparse_uniform':
+            return crawl_nemu_sparse_uniform_cpts(self.data_dir, self.workload_filter)
+        else:
+            return crawl_nemu_uniform_cpts(self.data_dir, self.workload_filter)
+
+    def find_cpts_with_index(self):
+        try:
+            return find_cpts_with_index(self.data_dir, self.cpt_kind(), self.workload_filter)
+        except (sqlite3.Error, OSError) as e:
+            print(f'Checkpoint index of {self.data_dir} is unusable ({e}), fall back to crawling')
+            self.use_cpt_index = False
+            return self.crawl_cpts()
+
     def set_task_filter(self):
         if self.args.task is not None:
             self.task_filter = [args.task]
@@ -112,31 +216,141 @@ class CptBatchDescription:
                 if not task.valid:
                     continue
 
-            if hashed:
-                hash_buckets, n_buckets = lb.get_machine_hash(task_type)
-                if hash(task) % n_buckets in hash_buckets:
-                    task.valid = True
-                else:
-                    continue
+            if hashed and not is_local_task(task.code_name, task_type):
+                # consistent hashing over the hosts of dispatch.json
+                continue
 
             if self.args.dry_run:
                 task.dry_run = True
+            task.timeout = self.args.timeout
+            task.stall_timeout = self.args.stall_timeout
+            task.cpt_cache = self.get_cpt_cache()
             self.tasks.append(task)
-        random.shuffle(self.tasks)
+        self.order_tasks()
+
+    def get_cpt_cache(self):
+        if self.args.cpt_cache is None:
+            return None
+        if self.cpt_cache is None:
+            self.cpt_cache = CptCache(self.args.cpt_cache,
+                    parse_mem_size(self.args.cpt_cache_size) * 1024, self.args.decompress)
+        return self.cpt_cache
+
+    def prefetcher(self, num_threads):
+        if self.args.prefetch <= 0:
+            return None
+        assert self.args.cpt_cache is not None, '--prefetch stages into the cache of --cpt-cache'
+        prefetcher = CptPrefetcher(self.tasks, self.args.prefetch, self.args.prefetch_threads)
+        prefetcher.start(num_threads)
+        return prefetcher
+
+    def order_tasks(self):
+        if self.args.schedule == 'ljf':
+            weights = load_simpoint_weights(self.simpoints_file) if self.is_simpoint else None
+            estimator = TaskCostEstimator(simpoint_weights=weights, history=RunHistory.load())
+            self.tasks = estimator.longest_first(self.tasks)
+        else:
+            random.shuffle(self.tasks)
+        if len({task.task_name for task in self.tasks}) > 1:
+            self.tasks = group_by_cpt(self.tasks)
+
+    def memory_gate(self, Gate=MemoryGate):
+        # Gate: MemoryGate shared by pool workers, or common.async_engine.AsyncMemoryGate
+        history = RunHistory.load()
+        for task in self.tasks:
+            task.mem_estimate_kb = estimate_task_mem_kb(task, history)
+        gate = Gate()
+        print(f'Admit tasks within {gate.budget_kb // 1024} MB')
+        return gate
+
+    def plan_file(self, Conf, task_name):
+        # a plan is valid for the same checkpoints, config, launcher and arguments
+        Confs = Conf if isinstance(Conf, (list, tuple)) else [Conf]
+        def file_hash(f):
+            if f is None or not osp.isfile(f):
+                return None
+            with open(f, 'rb') as fp:
+                return hashlib.sha1(fp.read()).hexdigest()
+        info = [
+                # tasks of hashed batches depend on the host
+                platform.node(), file_hash(lb.machine_config), file_hash(local_config_file),
+                osp.abspath(self.data_dir), os.stat(self.data_dir).st_mtime_ns,
+                self.exe, self.top_output_dir, task_name,
+                [f'{C.__module__}.{C.__qualname__}' for C in Confs],
+                [file_hash(getattr(sys.modules.get(C.__module__), '__file__', None)) for C in Confs],
+                file_hash(sys.argv[0]),
+                self.simpoints_file, file_hash(self.simpoints_file),
+                sorted(self.workload_filter), self.task_filter,
+                sorted((k, repr(v)) for k, v in vars(self.args).items() if k != 'replan'),
+                ]
+        key = hashlib.sha1(repr(info).encode()).hexdigest()
+        return osp.join(plan_cache_dir, f'{key}.pkl')
+
+    def load_plan(self, Conf, task_name):
+        # returns whether self.tasks is restored from the plan of a previous run,
+        # otherwise the launcher builds tasks and calls save_plan
+        self.task_name = task_name
+        if self.args.replan:
+            return False
+        plan_file = self.plan_file(Conf, task_name)
+        try:
+            with open(plan_file, 'rb') as f:
+                self.tasks = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return False
+        print(f'Loaded {len(self.tasks)} tasks from {plan_file}')
+        return True
+
+    def save_plan(self):
+        plan_file = self.plan_file(self._conf, self.task_name)
+        try:
+            os.makedirs(plan_cache_dir, exist_ok=True)
+            tmp = f'{plan_file}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(self.tasks, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, plan_file)
+        except OSError as e:
+            print(f'Failed to save the batch plan: {e}')
 
     def run(self, num_threads, debug=False):
         print(f'Run {len(self.tasks)} tasks with {num_threads} threads')
         if num_threads <= 0:
             return
         if debug:
-            task_wrapper(tasks[0])
+            task_wrapper(self.tasks[0])
+        elif all(task.dry_run for task in self.tasks):
+            # nothing to launch, no need of workers
+            for task in self.tasks:
+                task_wrapper(task)
+        elif self.args.serve is not None or self.args.coordinator is not None:
+            self.run_distributed(num_threads)
+        elif self.args.early_stop is not None:
+            self.run_adaptive(num_threads)
+        elif self.args.engine == 'asyncio':
+            from common import async_engine
+            from common.slot_allocator import SlotAllocator
+            allocator = SlotAllocator() if self.args.pin else None
+            prefetcher = self.prefetcher(num_threads)
+            gate = self.memory_gate(async_engine.AsyncMemoryGate) if self.args.mem_aware else None
+            results = async_engine.run_tasks(self.tasks, num_threads, allocator, prefetcher, gate)
+            print(f'Finished {len(results)} simulations')
+            if prefetcher is not None:
+                prefetcher.close()
         else:
-            p = Pool(num_threads)
+            from multiprocessing import Pool
+            from common.slot_allocator import SlotAllocator
+            allocator = SlotAllocator() if self.args.pin else None
+            gate = self.memory_gate() if self.args.mem_aware else None
+            p = Pool(num_threads, initializer=init_worker, initargs=(allocator, gate))
+            prefetcher = self.prefetcher(num_threads)
 
-            results = p.map(task_wrapper, self.tasks, chunksize=1)
+            # tasks are handed to whichever worker is free, in the order of self.tasks
+            results = p.imap_unordered(task_wrapper, self.tasks, chunksize=1)
             phases = []
             count = 0
             for res in results:
+                if prefetcher is not None:
+                    prefetcher.task_done()
                 if res is not None:
                     print(res)
                     # phases.append(res[1])
@@ -144,4 +358,117 @@ class CptBatchDescription:
             # print(sorted(phases))
             print(f'Finished {count} simulations')
             p.close()
+            if prefetcher is not None:
+                prefetcher.close()
+
+    def run_adaptive(self, num_threads):
+        import queue
+        from multiprocessing import Pool
+        from common.slot_allocator import SlotAllocator
+        from common.early_stop import EarlyStopScheduler
+        assert self.is_simpoint, '--early-stop needs simpoint weights'
+        assert len({task.task_name for task in self.tasks}) == 1, \
+                '--early-stop estimates one config at a time'
+        scheduler = EarlyStopScheduler([task for task in self.tasks if task.valid],
+                load_simpoint_weights(self.simpoints_file), self.args.early_stop,
+                self.args.confidence, self.args.min_points)
+
+        allocator = SlotAllocator() if self.args.pin else None
+        gate = self.memory_gate() if self.args.mem_aware else None
+        p = Pool(num_threads, initializer=init_worker, initargs=(allocator, gate))
+        # finished tasks come back through callbacks of the result thread
+        finished = queue.Queue()
+        in_flight = 0
+
+        def launch():
+            task = scheduler.next_task()
+            if task is None:
+                return False
+            p.apply_async(task_wrapper, (task,),
+                    callback=lambda res: finished.put(task),
+                    error_callback=lambda e: finished.put(task))
+            return True
+
+        for _ in range(num_threads):
+            if not launch():
+                break
+            in_flight += 1
+        count = 0
+        while in_flight > 0:
+            task = finished.get()
+            in_flight -= 1
+            count += 1
+            print((task.workload, task.sub_phase_id))
+            scheduler.task_done(task)
+            if launch():
+                in_flight += 1
+        p.close()
+        summary = scheduler.summary()
+        print(f'Finished {count} simulations, '
+                f'{sum(total - n for _, _, n, total in summary.values())} points not measured')
+        for workload, (cpi, error, n, total) in sorted(summary.items()):
+            if cpi is not None:
+                print(f'{workload}: CPI {cpi:.4f} +- {error:.2%} from {n}/{total} points')
+
+    def run_distributed(self, num_threads):
+        from multiprocessing import Pool
+        from common.slot_allocator import SlotAllocator
+        from load_balance.coordinator import serve, wait_drained, parse_address, load_authkey
+        serving = self.args.serve is not None
+        if self.args.authkey is not None:
+            authkey = self.args.authkey.encode()
+        else:
+            authkey = load_authkey(create=serving)
+        coordinator = None
+        if serving:
+            address = parse_address(self.args.serve)
+            coordinator = serve([task_key(task) for task in self.tasks if task.valid],
+                    address, authkey)
+            if address[0] == '0.0.0.0':
+                address = ('127.0.0.1', address[1])
+        else:
+            address = parse_address(self.args.coordinator)
+
+        allocator = SlotAllocator() if self.args.pin else None
+        gate = self.memory_gate() if self.args.mem_aware else None
+        p = Pool(num_threads, initializer=init_worker, initargs=(allocator, gate))
+        tasks = {task_key(task): task for task in self.tasks if task.valid}
+        counts = p.starmap(pull_and_run, [(address, authkey, tasks)] * num_threads, chunksize=1)
+        p.close()
+        print(f'Finished {sum(counts)} simulations on this host')
+        if coordinator is not None:
+            # workers on other hosts may still be running
+            print(wait_drained(coordinator))
+
+
+def group_by_cpt(tasks):
+    # tasks of a checkpoint one after another, in the order of their first task,
+    # so that a staged or page-cached checkpoint serves all configs of a sweep
+    groups = {}
+    for task in tasks:
+        groups.setdefault(task.cpt_file, []).append(task)
+    return [task for group in groups.values() for task in group]
+
+
+def task_key(task):
+    # code names repeat across the configs of a sweep
+    return f'{task.task_name}/{task.code_name}'
+
+
+def task_status(task):
+    for name in ['completed', 'timeout', 'aborted', 'running']:
+        if osp.isfile(task.marker(name)):
+            return name
+    return 'dry_run' if task.dry_run else 'unknown'
+
 
+def pull_and_run(address, authkey, tasks):
+    # pool worker of run_distributed, tasks: task_key -> task
+    from load_balance.coordinator import pull_tasks
+    def run_task(key):
+        if key not in tasks:
+            print(f'{key} is not a task of this host')
+            return 'unknown'
+        task_wrapper(tasks[key])
+        return task_status(tasks[key])
+    return pull_tasks(address, authkey, run_task)
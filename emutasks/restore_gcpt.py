@@ -9,6 +9,7 @@ from multiprocessing import Pool, Lock, Manager, Process
 
 from common.simulator_task_goback import SimulatorTaskGoBack
 from common.task_tree_go_back import task_tree_to_batch_task
+from common.slot_allocator import CpuSlot, SlotAllocator
 from emutasks.config import EmuTasksConfig
 
 # 运行： `PYTHONPATH=/path/to/this/project python3 /path/to/this/file [参数]`
@@ -84,24 +85,23 @@ def find_task(d: str):
             TaskSummary[workload][cpt] = cpt_file
     return TaskSummary
 
-def task_wrapper(task: SimulatorTaskGoBack, thread_num: int, cores_id: int, cores):
-    core_options = [
-        '-C',
-        str(cores_id * thread_num) + '-' + str(cores_id * thread_num + thread_num - 1)
-    ]
+def task_wrapper(task: SimulatorTaskGoBack, slot: CpuSlot, allocator: SlotAllocator):
+    core_options = slot.numactl_options()
     task.insert_direct_options(core_options, 0)
     is_goback = False
-    cycle_cnt = task.run(False)
-    simulator_success = (cycle_cnt == 0)
-    if not simulator_success:
-        print('simulator abort, go back...')
-        back_cycle_cnt =  cycle_cnt - 10000
-        task.add_direct_options(['-b', str(back_cycle_cnt), '-e', '-1', '--dump-wave'])
-        cycle_cnt = task.run(True)
+    try:
+        cycle_cnt = task.run(False)
         simulator_success = (cycle_cnt == 0)
-        is_goback = True
-    cores[cores_id] = 0
-    print(cores_id * thread_num, cores_id * thread_num + thread_num - 1, "simulator task finish")
+        if not simulator_success:
+            print('simulator abort, go back...')
+            back_cycle_cnt =  cycle_cnt - 10000
+            task.add_direct_options(['-b', str(back_cycle_cnt), '-e', '-1', '--dump-wave'])
+            cycle_cnt = task.run(True)
+            simulator_success = (cycle_cnt == 0)
+            is_goback = True
+    finally:
+        allocator.release(slot)
+    print(slot, "simulator task finish")
     # return simulator_success, is_goback, cycle_cnt, task.workload, task.sub_phase_id
     sys.exit()
 
@@ -144,21 +144,14 @@ if __name__ == "__main__":
 
         task.format_options()
 
-    with Manager()  as manager:
-        cores_list = [0] * int(MAX_CORE / THREADS_NUM)
-        cores = manager.list(cores_list)
-        task_id = 0
-        proc_list = []
-        while True:
-            if 0 not in cores:
-                continue
-            c_id = cores.index(0)
-            cores[c_id] = 1
-            if task_id >= len(tasks):
-                break
-            p = Process(target=task_wrapper, args=(tasks[task_id], THREADS_NUM, c_id, cores))
-            task_id += 1
-            p.start()
-            proc_list.append(p)
-        for proc in proc_list:
-            proc.join()
+    # one slot of THREADS_NUM cores inside a NUMA node per emu,
+    # acquire() blocks until a running emu releases its slot
+    allocator = SlotAllocator(THREADS_NUM, max_slots=MAX_CORE // THREADS_NUM)
+    proc_list = []
+    for task in tasks:
+        slot = allocator.acquire()
+        p = Process(target=task_wrapper, args=(task, slot, allocator))
+        p.start()
+        proc_list.append(p)
+    for proc in proc_list:
+        proc.join()
@@ -35,30 +35,33 @@ args = cpt_desc.parse_args()
 CurConf = EmuTasksConfig
 task_name = f'xs_simpoint_batch/SPEC{ver}_{CurConf.__name__}'
 cpt_desc.set_task_filter()
-cpt_desc.set_conf(CurConf, task_name)
-cpt_desc.filter_tasks(hashed=True, n_machines=3)
-
-debug_tick = None
-
-if args.debug_tick is not None:
-    debug_tick = args.debug_tick
-    debug_flags = frontend_flags + backend_flags
-
-
-for task in cpt_desc.tasks:
-    task.sub_workload_level_path_format()
-    task.set_trivial_workdir()
-    task.avoid_repeat = True
-
-    task.add_direct_options([])
-    task.add_dict_options({
-        '-W': str(10*10**6),
-        '-I': str(30*10**6),
-        '-i': task.cpt_file,
-        # '--gcpt-restorer': '/home/zyy/projects/NEMU/resource/gcpt_restore/build/gcpt.bin',
-        # '--gcpt-warmup': str(50*10**6),
-    })
-    task.format_options(space=True)
+if not cpt_desc.load_plan(CurConf, task_name):
+    cpt_desc.set_conf(CurConf, task_name)
+    cpt_desc.filter_tasks(hashed=True, n_machines=3)
+
+    debug_tick = None
+
+    if args.debug_tick is not None:
+        debug_tick = args.debug_tick
+        debug_flags = frontend_flags + backend_flags
+
+
+    for task in cpt_desc.tasks:
+        task.sub_workload_level_path_format()
+        task.set_trivial_workdir()
+        task.avoid_repeat = True
+
+        task.add_direct_options([])
+        task.add_dict_options({
+            '-W': str(10*10**6),
+            '-I': str(30*10**6),
+            '-i': task.cpt_file,
+            # '--gcpt-restorer': '/home/zyy/projects/NEMU/resource/gcpt_restore/build/gcpt.bin',
+            # '--gcpt-warmup': str(50*10**6),
+        })
+        task.format_options(space=True)
+    cpt_desc.save_plan()
+
 print(f'Output dir {top_output_dir}/{task_name}')
 print(len(cpt_desc.tasks))
 
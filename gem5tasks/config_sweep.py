@@ -0,0 +1,84 @@
+import sys
+import itertools
+
+# Config sweeps: several TypicalCoreConfig classes, crossed with a grid of
+#   window_size=128,192,256   the default_window_size of the class
+#   dq-groups=1,2             any other gem5 option, set after the class's own
+# become one batch (CptBatchDescription.set_confs), whose tasks of the same
+# checkpoint run next to each other.
+#
+# A variant is a subclass registered in the module of its base config, so that
+# tasks of it pickle to pool workers and to the plan cache like other configs.
+
+
+def parse_value(v: str):
+    try:
+        return int(v)
+    except ValueError:
+        return v
+
+
+def parse_grid(items):
+    # ['window_size=128,256', 'dq-groups=1,2'] -> {'window_size': [128, 256], '--dq-groups': [1, 2]}
+    grid = {}
+    for item in items or []:
+        key, sep, values = item.partition('=')
+        assert sep and len(values), f'Grid item {item} is not param=v1,v2,...'
+        if key != 'window_size' and not key.startswith('--'):
+            key = f'--{key}'
+        grid[key] = [parse_value(v) for v in values.split(',')]
+    return grid
+
+
+def variant_name(Conf, params: dict):
+    parts = [Conf.__name__]
+    for key, value in params.items():
+        if key == 'window_size':
+            parts.append(f'W{value}')
+        else:
+            parts.append(''.join(w.capitalize() for w in key.lstrip('-').split('-')) + str(value))
+    return '_'.join(parts)
+
+
+def config_variant(Conf, params: dict):
+    if not len(params):
+        return Conf
+    name = variant_name(Conf, params)
+    module = sys.modules[Conf.__module__]
+    if hasattr(module, name):
+        return getattr(module, name)
+    options = {k: v for k, v in params.items() if k != 'window_size'}
+
+    def __init__(self, exe: str, top_data_dir: str, task_name: str, workload: str, sub_phase: int):
+        Conf.__init__(self, exe, top_data_dir, task_name, workload, sub_phase)
+        self.add_dict_options(options)
+
+    attrs = {'__init__': __init__, '__module__': Conf.__module__, '__qualname__': name}
+    if 'window_size' in params:
+        attrs['default_window_size'] = params['window_size']
+    Variant = type(name, (Conf,), attrs)
+    setattr(module, name, Variant)
+    return Variant
+
+
+def expand_sweep(Confs, grid: dict):
+    # cross product of configs and grid values, in a stable order
+    keys = list(grid.keys())
+    return [config_variant(Conf, dict(zip(keys, values)))
+            for Conf in Confs
+            for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def sweep_configs(module, args, Default):
+    # configs of --sweep, or of -C, or the default, crossed with --grid
+    if args.sweep is not None:
+        names = args.sweep
+    elif args.config is not None:
+        names = [args.config]
+    else:
+        names = [Default.__name__]
+    Confs = []
+    for name in names:
+        assert hasattr(module, name), f'No config {name} in {module.__name__}'
+        Confs.append(getattr(module, name))
+    return expand_sweep(Confs, parse_grid(args.grid))
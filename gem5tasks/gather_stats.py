@@ -0,0 +1,42 @@
+import time
+import argparse
+import os.path as osp
+
+from common.gem5_stats import collect_simpoint_stats, default_counters
+
+# Gather stats of a gem5 simpoint batch and print SimPoint-weighted IPC/CPI:
+# `python3 gem5tasks/gather_stats.py -v 17 -d /path/to/test_new_wrapper17/FullWindowO3Config`
+
+repo_root = osp.dirname(osp.dirname(osp.abspath(__file__)))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-d', '--task-dir', type=str, action='store', required=True,
+        help='top_output_dir/task_name of the batch')
+parser.add_argument('-v', '--spec-version', help='`06` or `17`',
+        type=str, action='store', required=True, choices=['06', '17'])
+parser.add_argument('-s', '--simpoints-file', type=str, action='store',
+        help='default to resources/simpoint_cpt_desc/simpoints{ver}.json')
+parser.add_argument('-c', '--counters', type=str, action='store', nargs='+',
+        default=default_counters)
+parser.add_argument('-o', '--output', type=str, action='store',
+        help='where to save the table (npz), default to task_dir/stats.npz')
+parser.add_argument('-j', '--processes', type=int, action='store', default=16)
+parser.add_argument('-F', '--full', action='store_true',
+        help='ignore the manifest and reparse every stats.txt')
+args = parser.parse_args()
+
+simpoints_file = args.simpoints_file
+if simpoints_file is None:
+    simpoints_file = osp.join(repo_root, 'resources', 'simpoint_cpt_desc',
+            f'simpoints{args.spec_version}.json')
+output = args.output if args.output is not None else osp.join(args.task_dir, 'stats.npz')
+
+start = time.time()
+table = collect_simpoint_stats(args.task_dir, simpoints_file, args.counters, args.processes,
+        use_manifest=not args.full)
+table.save(output)
+print(f'Gathered stats of {len(table)} points in {time.time() - start:.2f}s, saved to {output}')
+
+print(f'{"workload":<24} {"IPC":>8} {"CPI":>8} {"coverage":>9} {"points":>7}')
+for workload, (ipc, cpi, coverage, n) in sorted(table.weighted().items()):
+    print(f'{workload:<24} {ipc:>8.4f} {cpi:>8.4f} {coverage:>9.4f} {n:>7}')
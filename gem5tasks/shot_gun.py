@@ -5,6 +5,7 @@ import os.path as osp
 from common import local_config as lc
 from cptdesc import CptBatchDescription
 import gem5tasks.typical_o3_config as tc
+from gem5tasks.config_sweep import sweep_configs
 
 debug = False
 
@@ -30,31 +31,31 @@ args = cpt_desc.parse_args()
 num_threads = args.threads
 assert 0 < num_threads < 128
 
-if args.config is not None:
-    CurConf = eval(f'tc.{args.config}')
-else:
-    CurConf = tc.FullWindowO3Config
-task_name = f'gem5_shotgun_cont_{ver}/{CurConf.__name__}'
+# -C, or --sweep and --grid for several configs in one batch
+Confs = sweep_configs(tc, args, tc.FullWindowO3Config)
+task_name = f'gem5_shotgun_cont_{ver}'
 cpt_desc.set_task_filter()
-cpt_desc.set_conf(CurConf, task_name)
-cpt_desc.filter_tasks()
-
-for task in cpt_desc.tasks:
-    task.sub_workload_level_path_format()
-    task.set_trivial_workdir()
-    task.avoid_repeat = True
-
-    task.add_direct_options([fs_script])
-    task.add_dict_options({
-        '--mem-size': '8GB',
-        '--generic-rv-cpt': task.cpt_file,
-        '--gcpt-restorer': '/home/zyy/projects/NEMU/resource/gcpt_restore/build/gcpt.bin',
-        '--maxinsts': str(50*10**6 + 16*50*10**6),
-        '--gcpt-warmup': str(50*10**6),
-        '--gcpt-repeat-interval': str(50*10**6),
-    })
-    task.format_options()
-    task.dry_run=False
+if not cpt_desc.load_plan(Confs, task_name):
+    cpt_desc.set_confs(Confs, task_name)
+    cpt_desc.filter_tasks()
+
+    for task in cpt_desc.tasks:
+        task.sub_workload_level_path_format()
+        task.set_trivial_workdir()
+        task.avoid_repeat = True
+
+        task.add_direct_options([fs_script])
+        task.add_dict_options({
+            '--mem-size': '8GB',
+            '--generic-rv-cpt': task.cpt_file,
+            '--gcpt-restorer': '/home/zyy/projects/NEMU/resource/gcpt_restore/build/gcpt.bin',
+            '--maxinsts': str(50*10**6 + 16*50*10**6),
+            '--gcpt-warmup': str(50*10**6),
+            '--gcpt-repeat-interval': str(50*10**6),
+        })
+        task.format_options()
+        task.dry_run=False
+    cpt_desc.save_plan()
 
 cpt_desc.run(num_threads, debug)
 
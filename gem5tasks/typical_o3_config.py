@@ -2,10 +2,14 @@ from common.simulator_task import SimulatorTask
 
 
 class TypicalCoreConfig(SimulatorTask):
+    # window_size of the subclasses, swept by gem5tasks.config_sweep
+    default_window_size = 192
+    cpi_reader = 'gem5'
+
     def __init__(self, exe: str, top_data_dir: str, task_name: str, workload: str, sub_phase: int):
         super().__init__(exe, top_data_dir, task_name, workload, sub_phase)
 
-        self.window_size = 192
+        self.window_size = self.default_window_size
 
         self.list_conf = [
             '--caches',
@@ -0,0 +1,268 @@
+import os
+import time
+import random
+import secrets
+import platform
+import argparse
+import threading
+from collections import deque, Counter
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+
+# Dynamic distribution of a batch over several hosts.
+# One launcher serves a Coordinator holding the task keys of the batch in
+# dispatch order; every worker process, on this host or another one running
+# the same launcher, pulls the next key, runs that task and reports its
+# status. Hosts thus drain the batch at their own speed, unlike the static
+# buckets of get_machine_hash.
+# A worker heartbeats while it runs a task. Tasks of a worker that has not
+# been heard of for lease seconds are handed out again, so a worker with
+# nothing to pull waits while tasks are still running elsewhere.
+#
+# The serving launcher keeps serving after the batch is finished until every
+# worker it has heard of got its end of batch, for at most drain_grace seconds;
+# a worker that loses the coordinator takes it as the end of the batch.
+#
+# The manager unpickles what it receives: it listens on 127.0.0.1 unless a
+# host is given, and authenticates with a random key kept in a private file
+# under the (shared) home dir, or with --authkey.
+
+default_port = 50920
+default_lease = 600
+heartbeat_interval = 60
+wait_interval = 10
+drain_grace = 3 * wait_interval
+authkey_file = os.path.expanduser('~/.config/machine_state/coordinator_authkey')
+# returned by next_task while nothing is pending but tasks are running
+wait_key = '<wait>'
+
+
+class Coordinator:
+    def __init__(self, keys, lease=default_lease):
+        self.pending = deque(keys)
+        # key -> worker
+        self.running = {}
+        # key -> (worker, status)
+        self.done = {}
+        self.last_seen = {}
+        # workers told that the batch is finished
+        self.released = set()
+        self.lease = lease
+        self.lock = threading.Lock()
+
+    def requeue_lost(self):
+        now = time.time()
+        lost = [key for key, worker in self.running.items()
+                if now - self.last_seen.get(worker, now) > self.lease]
+        for key in lost:
+            print(f'{key}: {self.running[key]} is lost, requeue')
+            del self.running[key]
+            self.pending.appendleft(key)
+
+    def next_task(self, worker):
+        # returns a task key, wait_key while running tasks may still be requeued,
+        # or None when the batch is finished
+        with self.lock:
+            self.last_seen[worker] = time.time()
+            self.requeue_lost()
+            if not len(self.pending):
+                if len(self.running):
+                    return wait_key
+                self.released.add(worker)
+                return None
+            key = self.pending.popleft()
+            self.running[key] = worker
+            return key
+
+    def heartbeat(self, worker):
+        with self.lock:
+            self.last_seen[worker] = time.time()
+
+    def report(self, key, worker, status):
+        with self.lock:
+            self.last_seen[worker] = time.time()
+            if self.running.get(key) == worker:
+                del self.running[key]
+            self.done[key] = (worker, status)
+
+    def finished(self):
+        with self.lock:
+            self.requeue_lost()
+            return not len(self.pending) and not len(self.running)
+
+    def all_released(self):
+        # every worker heard of within the lease got its end of batch
+        with self.lock:
+            now = time.time()
+            return all(worker in self.released for worker, seen in self.last_seen.items()
+                    if now - seen <= self.lease)
+
+    def summary(self):
+        with self.lock:
+            return {
+                    'pending': len(self.pending),
+                    'running': len(self.running),
+                    'status': dict(Counter(status for _, status in self.done.values())),
+                    'hosts': dict(Counter(worker.split(':')[0] for worker, _ in self.done.values())),
+                    }
+
+
+class CoordinatorServer(BaseManager):
+    pass
+
+
+class CoordinatorClient(BaseManager):
+    pass
+
+
+CoordinatorClient.register('coordinator')
+
+
+def parse_address(address: str):
+    # `host:port`, `host` or `:port`, localhost if no host is given
+    host, _, port = address.rpartition(':') if ':' in address else (address, '', '')
+    return host or '127.0.0.1', int(port) if port else default_port
+
+
+def load_authkey(create=False):
+    # the key of authkey_file, created with a random key by the serving side
+    if create and not os.path.isfile(authkey_file):
+        os.makedirs(os.path.dirname(authkey_file), exist_ok=True)
+        try:
+            fd = os.open(authkey_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+    assert os.path.isfile(authkey_file), \
+            f'No {authkey_file}: start the --serve side first, or pass --authkey'
+    assert os.stat(authkey_file).st_mode & 0o077 == 0, f'{authkey_file} is readable by others'
+    with open(authkey_file) as f:
+        return f.read().strip().encode()
+
+
+def serve(keys, address, authkey: bytes, lease=default_lease):
+    # serves from a thread of this process, returns the Coordinator itself
+    coordinator = Coordinator(keys, lease)
+    CoordinatorServer.register('coordinator', callable=lambda: coordinator)
+    server = CoordinatorServer(address=address, authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Coordinator of {len(keys)} tasks listening on {address[0]}:{address[1]}')
+    return coordinator
+
+
+def connect(address, authkey: bytes, retries=30):
+    for i in range(retries):
+        try:
+            client = CoordinatorClient(address=address, authkey=authkey)
+            client.connect()
+            return client.coordinator()
+        except ConnectionRefusedError:
+            if i == retries - 1:
+                raise
+            time.sleep(1)
+
+
+def worker_name():
+    return f'{platform.node()}:{os.getpid()}'
+
+
+class Heartbeat:
+    def __init__(self, address, authkey, worker):
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, args=(address, authkey, worker), daemon=True)
+
+    def beat(self, address, authkey, worker):
+        # a connection of its own, proxies are not shared between threads
+        try:
+            coordinator = connect(address, authkey)
+            while not self.stopped.wait(heartbeat_interval):
+                coordinator.heartbeat(worker)
+        except (EOFError, ConnectionError):
+            # the coordinator is gone, pull_tasks finds out by itself
+            pass
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+
+
+def pull_tasks(address, authkey, run_task):
+    # worker loop: run_task(key) returns the status to report, returns the number of tasks run
+    # A coordinator that cannot be reached has finished the batch and exited.
+    worker = worker_name()
+    count = 0
+    try:
+        coordinator = connect(address, authkey)
+    except ConnectionError as e:
+        print(f'No coordinator at {address[0]}:{address[1]}: {e}')
+        return count
+    with Heartbeat(address, authkey, worker):
+        while True:
+            try:
+                key = coordinator.next_task(worker)
+            except (EOFError, ConnectionError):
+                print(f'Coordinator at {address[0]}:{address[1]} is gone, end of batch')
+                return count
+            if key is None:
+                return count
+            if key == wait_key:
+                # a lost task may come back
+                time.sleep(wait_interval)
+                continue
+            try:
+                status = run_task(key)
+            except Exception as e:
+                print(f'{key}: {e}')
+                status = 'error'
+            count += 1
+            try:
+                coordinator.report(key, worker, status)
+            except (EOFError, ConnectionError):
+                print(f'Coordinator at {address[0]}:{address[1]} is gone, {key} is not reported')
+                return count
+
+
+def wait_drained(coordinator, poll_interval=10, grace=drain_grace):
+    # returns once the batch is finished and its workers know it, the server
+    # of serve dies with this process
+    while not coordinator.finished():
+        time.sleep(poll_interval)
+    # workers waiting on wait_key learn it at their next poll
+    deadline = time.time() + grace
+    while not coordinator.all_released() and time.time() < deadline:
+        time.sleep(min(poll_interval, 1))
+    return coordinator.summary()
+
+
+def _demo_worker(address, authkey, max_sleep):
+    def run_task(key):
+        time.sleep(random.uniform(0, max_sleep))
+        return 'completed'
+    n = pull_tasks(address, authkey, run_task)
+    print(f'{worker_name()} ran {n} tasks')
+
+
+if __name__ == '__main__':
+    # several workers on one machine drain a batch of sleeps
+    parser = argparse.ArgumentParser(description='Drain a dummy batch through a coordinator')
+    parser.add_argument('-n', '--tasks', type=int, default=100)
+    parser.add_argument('-w', '--workers', type=int, default=4)
+    parser.add_argument('-p', '--port', type=int, default=default_port)
+    parser.add_argument('--max-sleep', type=float, default=0.05)
+    args = parser.parse_args()
+
+    address = ('127.0.0.1', args.port)
+    authkey = secrets.token_bytes(32)
+    coordinator = serve([f'task_{i}' for i in range(args.tasks)], address, authkey)
+    workers = [Process(target=_demo_worker, args=(address, authkey, args.max_sleep))
+            for _ in range(args.workers)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    print(wait_drained(coordinator, 0.1))
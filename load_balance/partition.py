@@ -0,0 +1,102 @@
+import json
+import random
+import hashlib
+import argparse
+import platform
+from bisect import bisect_right
+from collections import Counter
+
+from .load_balance import machine_config
+
+# Partitioning of a batch over the hosts of dispatch.json by consistent hashing.
+# Each host owns `load * vnodes_per_load` points on a ring of 64-bit hashes, and
+# a task belongs to the host of the first point after sha256(code_name).
+# The hash is the same in every process and on every host, unlike hash(task),
+# and adding or removing a host only moves the tasks of the points it takes
+# or gives up, about load / total_load of the batch.
+
+vnodes_per_load = 128
+
+
+def stable_hash(s: str):
+    return int.from_bytes(hashlib.sha256(s.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, loads: dict, vnodes=vnodes_per_load):
+        # loads: host -> load
+        points = sorted((stable_hash(f'{host}#{i}'), host)
+                for host, load in loads.items() for i in range(load * vnodes))
+        assert len(points), 'No host has any load'
+        self.loads = dict(loads)
+        self.points = [p for p, _ in points]
+        self.hosts = [host for _, host in points]
+
+    def host_of(self, key: str):
+        i = bisect_right(self.points, stable_hash(key))
+        return self.hosts[i % len(self.hosts)]
+
+    def partition(self, keys):
+        parts = {host: [] for host in self.loads}
+        for key in keys:
+            parts[self.host_of(key)].append(key)
+        return parts
+
+
+_rings = {}
+
+
+def machine_ring(task='xiangshan', config=machine_config):
+    # dispatch.json is read once per process
+    if (task, config) not in _rings:
+        with open(config) as f:
+            js = json.load(f)[task]
+        _rings[(task, config)] = HashRing({host: js[host]['load'] for host in js})
+        print(f'Partition {task} tasks over', {host: js[host]['load'] for host in js})
+    return _rings[(task, config)]
+
+
+def is_local_task(code_name: str, task='xiangshan', host=None):
+    return machine_ring(task).host_of(code_name) == (host or platform.node())
+
+
+def _report(loads, n_keys):
+    # balance of a partition and the tasks moved by adding or removing a host
+    keys = [f'workload{random.randrange(100)}_{random.randrange(10**12)}' for _ in range(n_keys)]
+    ring = HashRing(loads)
+    owners = {key: ring.host_of(key) for key in keys}
+    counts = Counter(owners.values())
+    total = sum(loads.values())
+    for host, load in loads.items():
+        print(f'{host}: {counts[host]} tasks, {counts[host] / n_keys:.3f} of the batch '
+                f'for {load / total:.3f} of the load')
+
+    added = dict(loads, new_host=max(loads.values()))
+    ring_added = HashRing(added)
+    moved = [key for key in keys if ring_added.host_of(key) != owners[key]]
+    assert all(ring_added.host_of(key) == 'new_host' for key in moved)
+    print(f'Adding new_host moves {len(moved) / n_keys:.3f} of the batch, '
+            f'{added["new_host"] / sum(added.values()):.3f} expected, all to new_host')
+
+    removed_host = next(iter(loads))
+    ring_removed = HashRing({h: l for h, l in loads.items() if h != removed_host})
+    moved = [key for key in keys if ring_removed.host_of(key) != owners[key]]
+    assert all(owners[key] == removed_host for key in moved)
+    print(f'Removing {removed_host} moves {len(moved) / n_keys:.3f} of the batch, '
+            f'only its own tasks')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Balance and stability of the partition')
+    parser.add_argument('-c', '--config', default=machine_config)
+    parser.add_argument('-t', '--task', default='xiangshan')
+    parser.add_argument('-n', '--keys', type=int, default=100000)
+    parser.add_argument('--demo', action='store_true', help='use made-up hosts instead of the config')
+    args = parser.parse_args()
+
+    if args.demo:
+        loads = {'node0': 4, 'node1': 2, 'node2': 1, 'node3': 1}
+    else:
+        with open(args.config) as f:
+            loads = {host: v['load'] for host, v in json.load(f)[args.task].items()}
+    _report(loads, args.keys)
@@ -0,0 +1,49 @@
+import unittest
+from collections import Counter
+
+from .partition import HashRing
+
+# Balance and stability of HashRing on a fixed set of keys, so that the
+# result is the same on every run.
+
+loads = {'node0': 4, 'node1': 2, 'node2': 1, 'node3': 1}
+keys = [f'workload{i % 100}_{i}' for i in range(20000)]
+# of the batch, off the load share of a host
+tolerance = 0.03
+
+
+class TestHashRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = HashRing(loads)
+        self.owners = {key: self.ring.host_of(key) for key in keys}
+
+    def test_balance(self):
+        counts = Counter(self.owners.values())
+        total = sum(loads.values())
+        for host, load in loads.items():
+            self.assertAlmostEqual(counts[host] / len(keys), load / total, delta=tolerance,
+                    msg=host)
+
+    def test_partition_matches_host_of(self):
+        parts = self.ring.partition(keys)
+        self.assertEqual(sum(len(p) for p in parts.values()), len(keys))
+        for host, part in parts.items():
+            self.assertTrue(all(self.owners[key] == host for key in part))
+
+    def test_add_host(self):
+        added = dict(loads, node4=2)
+        ring = HashRing(added)
+        moved = [key for key in keys if ring.host_of(key) != self.owners[key]]
+        self.assertTrue(all(ring.host_of(key) == 'node4' for key in moved))
+        self.assertAlmostEqual(len(moved) / len(keys), added['node4'] / sum(added.values()),
+                delta=tolerance)
+
+    def test_remove_host(self):
+        ring = HashRing({host: load for host, load in loads.items() if host != 'node1'})
+        moved = [key for key in keys if ring.host_of(key) != self.owners[key]]
+        self.assertTrue(all(self.owners[key] == 'node1' for key in moved))
+        self.assertEqual(len(moved), Counter(self.owners.values())['node1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import os
+import math
+import os.path as osp
+from bisect import bisect_right
+
+from common.simulator_task import task_wrapper
+
+# Planning NEMU checkpoint generation.
+# Each target point is restored from the nearest earlier checkpoint, which is
+# either an available one or the checkpoint produced for an earlier simpoint
+# of the same workload in this batch. Tasks that use a produced checkpoint
+# form a chain and run one after another in the same worker.
+# A chain trades parallelism for fast-forward: by default it is cut where it
+# would take longer than the farthest point of its workload restored on its
+# own, so that chaining does not make a batch slower on a wide machine.
+
+# NEMU takes the checkpoint this many instructions after the target start
+cpt_offset = 1000
+# fast-forward that takes about as long as writing and restoring a checkpoint
+cpt_overhead_insts = 10**9
+
+
+class CptSourceIndex:
+    # sorted available checkpoints of one workload
+    def __init__(self, cpts: dict):
+        self.points = sorted(cpts.keys())
+        self.files = [cpts[k] for k in self.points]
+
+    def nearest_before(self, inst):
+        # returns (point, file), (0, None) if there is none
+        i = bisect_right(self.points, inst)
+        if i == 0:
+            return 0, None
+        return self.points[i - 1], self.files[i - 1]
+
+
+class PlannedCpt:
+    def __init__(self, start, avail_point, avail_file, prev=None):
+        self.start = start
+        # nearest available checkpoint
+        self.avail_point = avail_point
+        self.avail_file = avail_file
+        # the planned checkpoint whose output is restored, or None
+        self.prev = prev
+        if prev is not None:
+            self.source_point, self.source_file = prev.produced_point, None
+        else:
+            self.source_point, self.source_file = avail_point, avail_file
+
+    @property
+    def produced_point(self):
+        return self.start + cpt_offset
+
+    @property
+    def fast_forward(self):
+        return self.start - self.source_point
+
+
+def plan_workload(starts, index: CptSourceIndex, max_chain_insts=None):
+    # starts: target inst counts of one workload
+    # max_chain_insts: fast-forward of a chain, checkpoint overheads included,
+    # by default that of the farthest point restored on its own
+    # returns chains, each a list of PlannedCpt where every one but the first
+    # restores from its predecessor
+    if max_chain_insts is None:
+        max_chain_insts = max((start - index.nearest_before(start)[0] for start in starts),
+                default=0)
+    chains = []
+    prev = None
+    chain_insts = 0
+    for start in sorted(starts):
+        point, f = index.nearest_before(start)
+        plan = PlannedCpt(start, point, f)
+        if prev is not None and point < prev.produced_point <= start:
+            chained = PlannedCpt(start, point, f, prev)
+            if chain_insts + cpt_overhead_insts + chained.fast_forward <= max_chain_insts:
+                plan = chained
+        if plan.prev is None:
+            chains.append([])
+            chain_insts = 0
+        else:
+            chain_insts += cpt_overhead_insts
+        chains[-1].append(plan)
+        chain_insts += plan.fast_forward
+        prev = plan
+    return chains
+
+
+def plan_summary(chains):
+    n_chained = sum(len(chain) - 1 for chain in chains)
+    ff = sum(plan.fast_forward for chain in chains for plan in chain)
+    return n_chained, ff
+
+
+def produced_cpt(task):
+    # NEMU writes the checkpoint to log_dir/0/<cpt>.gz
+    cpt_dir = osp.join(task.log_dir, '0')
+    if not osp.isdir(cpt_dir):
+        return None
+    files = os.listdir(cpt_dir)
+    if not len(files):
+        return None
+    return osp.join(cpt_dir, files[0])
+
+
+def apply_source(task, plan: PlannedCpt, source_point, source_file):
+    if source_file is not None:
+        task.add_dict_options({
+            '-c': source_file,
+            })
+    task.add_dict_options({  # How many instructions have to execute before take cpt
+        '--checkpoint-interval': plan.start - source_point + cpt_offset,
+        '--max-insts': plan.start - source_point + cpt_offset + 500,
+        })
+    task.format_options(space=True)
+
+
+def run_cpt_chain(chain):
+    # chain: [(task, PlannedCpt)], options of tasks are complete except the source
+    results = []
+    prev_task = None
+    for task, plan in chain:
+        source_point, source_file = plan.source_point, plan.source_file
+        if plan.prev is not None:
+            source_file = produced_cpt(prev_task) if prev_task is not None else None
+            if source_file is None:
+                # the predecessor failed, restore as if it was not planned
+                source_point, source_file = plan.avail_point, plan.avail_file
+        apply_source(task, plan, source_point, source_file)
+        results.append(task_wrapper(task))
+        prev_task = task
+    return results
+
+
+def plan_balanced_chains(starts_of_workload: dict, indexes: dict, n_slots):
+    # A chain runs in one worker: chains of a workload are cut where they would
+    # fast-forward more than an even share of the whole batch on n_slots cores.
+    one_pass = {w: plan_workload(starts, indexes[w], math.inf)
+            for w, starts in starts_of_workload.items()}
+    total = sum(plan_summary(chains)[1] for chains in one_pass.values())
+    max_chain_insts = total / n_slots
+    chains_of_workload = {}
+    for w, chains in one_pass.items():
+        if any(sum(plan.fast_forward for plan in chain) > max_chain_insts for chain in chains):
+            chains = plan_workload(starts_of_workload[w], indexes[w], max_chain_insts)
+        chains_of_workload[w] = chains
+    return chains_of_workload
+
+
+# Multi-checkpoint NEMU runs of uniform checkpoints: one invocation restores
+# once and takes the periodic checkpoints (--checkpoint-interval) of several
+# consecutive chunks of a workload on its way.
+
+
+class CptSegment:
+    def __init__(self, workload, source_point, source_file, points, tail=cpt_offset):
+        self.workload = workload
+        self.source_point = source_point
+        self.source_file = source_file
+        self.points = points
+        # instructions run after the last point, until its checkpoint is taken
+        self.tail = tail
+
+    @property
+    def span(self):
+        # instructions executed by the invocation
+        return self.points[-1] + self.tail - self.source_point
+
+
+def plan_segments(workload, starts, index: CptSourceIndex, max_span=None, tail=cpt_offset):
+    # consecutive points share an invocation until it would run more than max_span,
+    # and a later checkpoint is available to restore a new one from
+    segments = []
+    for start in sorted(starts):
+        point, f = index.nearest_before(start)
+        if len(segments):
+            seg = segments[-1]
+            if max_span is None or start + tail - seg.source_point <= max_span \
+                    or point <= seg.source_point:
+                seg.points.append(start)
+                continue
+        segments.append(CptSegment(workload, point, f, [start], tail))
+    return segments
+
+
+def plan_balanced_segments(starts_of_workload: dict, indexes: dict, n_slots, tail=cpt_offset):
+    # A workload is taken in one pass unless that pass is longer than an even
+    # share of the whole batch on n_slots cores; then it is cut into segments.
+    one_pass = {w: plan_segments(w, starts, indexes[w], tail=tail)
+            for w, starts in starts_of_workload.items()}
+    total = sum(seg.span for segs in one_pass.values() for seg in segs)
+    max_span = total / n_slots
+    segments = []
+    for w, segs in one_pass.items():
+        if len(segs) and max(seg.span for seg in segs) > max_span:
+            segs = plan_segments(w, starts_of_workload[w], indexes[w], max_span, tail)
+        segments += segs
+    # longest first, so that the batch ends evenly
+    segments.sort(key=lambda seg: seg.span, reverse=True)
+    return segments
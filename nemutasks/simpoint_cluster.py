@@ -0,0 +1,233 @@
+import os
+import gzip
+import argparse
+import os.path as osp
+from multiprocessing import Pool
+
+import numpy as np
+
+from common.simpoint_parser import read_simpoints
+
+# SimPoint analysis of NEMU basic block vectors, in place of the SimPoint 3.2 binary:
+#   NEMU --simpoint-profile: <profile dir>/<workload>/.../simpoint_bbv.gz
+#   this stage:              simpoint_profile_{ver}/<workload>/{simpoints0, weights0}
+#   take_simpoint_cpt.py reads the latter.
+#
+# As SimPoint 3.2, every interval vector is normalized to frequencies and
+# randomly projected to a few dimensions, then k-means runs for k = 1..max_k
+# and the smallest k whose BIC reaches bic_threshold of the BIC range is
+# taken. A cluster is represented by the interval closest to its centroid and
+# weighted by its share of intervals.
+#
+# Consecutive profile intervals can be merged (--merge), so simpoints of a
+# longer interval length come from the same profile.
+
+bbv_file_name = 'simpoint_bbv.gz'
+projected_dims = 15
+max_k = 30
+n_init = 5
+max_iter = 100
+bic_threshold = 0.9
+default_seed = 42
+
+
+def find_bbv_file(workload_dir):
+    for root, dirs, files in os.walk(workload_dir):
+        if bbv_file_name in files:
+            return osp.join(root, bbv_file_name)
+    return None
+
+
+def read_bbv(filename):
+    # `T:block:count :block:count ...` per interval -> (rows, blocks, counts)
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt') as f:
+        lines = [line for line in f.read().splitlines() if line.startswith('T')]
+    tokens = [np.array(line[1:].replace(':', ' ').split(), dtype=np.int64) for line in lines]
+    lengths = np.array([len(t) // 2 for t in tokens], dtype=np.int64)
+    pairs = np.concatenate(tokens).reshape(-1, 2) if len(tokens) else np.zeros((0, 2), dtype=np.int64)
+    rows = np.repeat(np.arange(len(tokens)), lengths)
+    return rows, pairs[:, 0], pairs[:, 1], len(tokens)
+
+
+def merge_intervals(rows, n_intervals, merge):
+    # m consecutive intervals become one; a partial tail is dropped
+    n = n_intervals // merge
+    keep = rows < n * merge
+    return rows // merge, keep, n
+
+
+def project(rows, blocks, counts, n_intervals, dims=projected_dims, seed=default_seed):
+    # frequency vectors times a random [-1, 1] matrix, without forming them densely
+    totals = np.bincount(rows, weights=counts, minlength=n_intervals)
+    freqs = counts / np.maximum(totals[rows], 1)
+    block_ids, columns = np.unique(blocks, return_inverse=True)
+    rng = np.random.default_rng(seed)
+    projection = rng.uniform(-1.0, 1.0, size=(len(block_ids), dims))
+    projected = np.empty((n_intervals, dims))
+    for d in range(dims):
+        projected[:, d] = np.bincount(rows, weights=freqs * projection[columns, d],
+                minlength=n_intervals)
+    return projected
+
+
+def squared_distances(x, centers, x_norms=None):
+    if x_norms is None:
+        x_norms = (x * x).sum(axis=1)
+    d = x_norms[:, None] - 2 * x @ centers.T + (centers * centers).sum(axis=1)[None, :]
+    return np.maximum(d, 0)
+
+
+def cluster_sums(x, labels, k):
+    # per-cluster sums of rows in one bincount
+    dims = x.shape[1]
+    index = (labels[:, None] * dims + np.arange(dims)).ravel()
+    return np.bincount(index, weights=x.ravel(), minlength=k * dims).reshape(k, dims)
+
+
+def kmeans_plus_plus(x, k, rng):
+    centers = [x[rng.integers(len(x))]]
+    closest = squared_distances(x, centers[0][None, :])[:, 0]
+    for _ in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            centers.append(x[rng.integers(len(x))])
+            continue
+        centers.append(x[rng.choice(len(x), p=closest / total)])
+        closest = np.minimum(closest, squared_distances(x, centers[-1][None, :])[:, 0])
+    return np.array(centers)
+
+
+def kmeans(x, k, rng, n_init=n_init, max_iter=max_iter):
+    # -> (labels, centers, distortion) of the best of n_init runs
+    best = None
+    x_norms = (x * x).sum(axis=1)
+    for _ in range(n_init):
+        centers = kmeans_plus_plus(x, k, rng)
+        labels = None
+        for _ in range(max_iter):
+            new_labels = squared_distances(x, centers, x_norms).argmin(axis=1)
+            if labels is not None and np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            sizes = np.bincount(labels, minlength=k)
+            sums = cluster_sums(x, labels, k)
+            # empty clusters keep their center
+            filled = sizes > 0
+            centers[filled] = sums[filled] / sizes[filled, None]
+        distortion = ((x - centers[labels])**2).sum()
+        if best is None or distortion < best[2]:
+            best = (labels, centers, distortion)
+    return best
+
+
+def bic(x, labels, centers, distortion):
+    # Pelleg and Moore's BIC of a spherical Gaussian mixture, as SimPoint scores k
+    n, dims = x.shape
+    k = len(centers)
+    sizes = np.bincount(labels, minlength=k)
+    sizes = sizes[sizes > 0]
+    if n <= k:
+        return -np.inf
+    variance = max(distortion / (dims * (n - k)), 1e-300)
+    likelihood = (sizes * np.log(sizes) - sizes * np.log(n)
+            - sizes * dims / 2 * np.log(2 * np.pi * variance)
+            - (sizes - 1) * dims / 2).sum()
+    params = (k - 1) + k * dims + 1
+    return likelihood - params / 2 * np.log(n)
+
+
+def pick_simpoints(x, max_k=max_k, seed=default_seed):
+    # -> (intervals, weights) of the chosen clustering
+    rng = np.random.default_rng(seed)
+    results = []
+    for k in range(1, min(max_k, len(x)) + 1):
+        labels, centers, distortion = kmeans(x, k, rng)
+        results.append((bic(x, labels, centers, distortion), labels, centers))
+    scores = np.array([r[0] for r in results])
+    finite = scores[np.isfinite(scores)]
+    if len(finite):
+        lo, hi = finite.min(), finite.max()
+        good = np.isfinite(scores) & (scores - lo >= bic_threshold * (hi - lo))
+        _, labels, centers = results[int(np.argmax(good))]
+    else:
+        # no BIC, e.g. a single interval: k = 1
+        _, labels, centers = results[0]
+
+    distances = ((x - centers[labels])**2).sum(axis=1)
+    intervals = []
+    weights = []
+    for c in np.unique(labels):
+        members = np.flatnonzero(labels == c)
+        intervals.append(int(members[np.argmin(distances[members])]))
+        weights.append(len(members) / len(x))
+    return np.array(intervals), np.array(weights)
+
+
+def write_simpoints(out_dir, intervals, weights):
+    # `value cluster` per line, as SimPoint 3.2 writes them
+    os.makedirs(out_dir, exist_ok=True)
+    with open(osp.join(out_dir, 'simpoints0'), 'w') as f:
+        f.writelines(f'{i} {c}\n' for c, i in enumerate(intervals))
+    with open(osp.join(out_dir, 'weights0'), 'w') as f:
+        f.writelines(f'{w} {c}\n' for c, w in enumerate(weights))
+
+
+def cluster_workload(args):
+    # -> (workload, intervals, simpoints, error or None), a bad profile does not stop the batch
+    workload, bbv_file, out_dir, merge, k, seed = args
+    try:
+        rows, blocks, counts, n_intervals = read_bbv(bbv_file)
+        if merge > 1:
+            rows, keep, n_intervals = merge_intervals(rows, n_intervals, merge)
+            rows, blocks, counts = rows[keep], blocks[keep], counts[keep]
+        if n_intervals == 0:
+            return workload, 0, 0, None
+        x = project(rows, blocks, counts, n_intervals, seed=seed)
+        intervals, weights = pick_simpoints(x, k, seed)
+        write_simpoints(osp.join(out_dir, workload), intervals, weights)
+    except Exception as e:
+        return workload, 0, 0, f'{type(e).__name__}: {e}'
+    return workload, n_intervals, len(intervals), None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pick simpoints from NEMU BBV profiles')
+    parser.add_argument('-i', '--profile-dir', required=True,
+            help=f'dir of <workload>/.../{bbv_file_name}')
+    parser.add_argument('-o', '--output-dir', required=True,
+            help='simpoint_profile dir to write <workload>/{simpoints0, weights0}')
+    parser.add_argument('-m', '--merge', type=int, default=1,
+            help='profile intervals per simpoint interval')
+    parser.add_argument('-k', '--max-k', type=int, default=max_k)
+    parser.add_argument('--seed', type=int, default=default_seed)
+    parser.add_argument('-w', '--workloads', nargs='+', help='only these workloads')
+    parser.add_argument('-j', '--threads', type=int, default=16)
+    parser.add_argument('--interval', type=int, default=50 * 10**6,
+            help='instructions of a simpoint interval, for the summary')
+    args = parser.parse_args()
+    assert args.merge >= 1
+
+    jobs = []
+    for workload in sorted(os.listdir(args.profile_dir)):
+        if args.workloads is not None and workload not in args.workloads:
+            continue
+        bbv_file = find_bbv_file(osp.join(args.profile_dir, workload))
+        if bbv_file is None:
+            print(f'No {bbv_file_name} of {workload}')
+            continue
+        jobs.append((workload, bbv_file, args.output_dir, args.merge, args.max_k, args.seed))
+
+    with Pool(max(1, min(args.threads, len(jobs)))) as p:
+        for workload, n_intervals, n_points, error in p.imap_unordered(cluster_workload, jobs,
+                chunksize=1):
+            if error is not None:
+                print(f'{workload}: failed, {error}')
+                continue
+            if n_points == 0:
+                print(f'{workload}: empty profile')
+                continue
+            points = read_simpoints(osp.join(args.output_dir, workload, 'simpoints0'),
+                    osp.join(args.output_dir, workload, 'weights0'), args.interval, args.interval)
+            print(f'{workload}: {n_points} simpoints of {n_intervals} intervals, '
+                    f'heaviest {points["weight"].max():.3f}')
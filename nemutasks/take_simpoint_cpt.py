@@ -7,16 +7,26 @@ import argparse
 from pprint import pprint
 from multiprocessing import Pool
 
-from common.simulator_task import SimulatorTask, task_wrapper
+from common.simulator_task import SimulatorTask
+from common.slot_allocator import pinned_pool
 from common.task_tree import task_tree_to_batch_task
 from common.simpoint_parser import parse_simpoint_analysis_file
+from common.cpt_store import CptStore, build_hash
 from gem5tasks.typical_o3_config import TypicalO3Config
+from nemutasks.cpt_planner import CptSourceIndex, plan_workload, plan_summary, run_cpt_chain, \
+        plan_balanced_chains
 
 # NEMU batch
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-v', '--spec-version', help='`06` or `17`',
         type=str, action='store', required=True, choices=['06', '17'])
+parser.add_argument('-M', '--multi', action='store_true',
+        help='cut chains that fast-forward more than an even share of the batch on -j cores')
+parser.add_argument('-j', '--threads', type=int, action='store', default=80)
+parser.add_argument('-s', '--store', type=str, action='store',
+        help='checkpoint store: link the simpoints it holds instead of taking them again, '
+        'and add the new checkpoints to it')
 args = parser.parse_args()
 ver = args.spec_version
 
@@ -59,83 +69,105 @@ def get_avail_cpts(d):
 avail_cpts = get_avail_cpts(avail_cpt_dir)
 # print(avail_cpts)
 
-batch_tasks = []
+def make_task(workload, phased_workload, start):
+    task = SimulatorTask(exe, top_output_dir,
+            task_name=batch_task_name,
+            workload=phased_workload,
+            sub_phase=start,
+            avoid_repeat=True,
+            )
+    task.workload_level_path_format()
+    task.set_trivial_workdir()
+    task.add_direct_options([
+        f'/home51/zyy/projects/NEMU/bbl_kernel_gen/spec{ver}_bbl/{workload}.bbl.bin',
+        ])
+    task.add_dict_options({
+        '-D': top_output_dir,
+        '-C': batch_task_name,
+        '-w': phased_workload,
+        '--sdcard-img': '/home51/zyy/projects/NEMU/rv-debian-spec-6G-fix-sphinx.img',
+        })
+    task.add_list_options([
+        '-b',
+        ])
+    task.dry_run = False
+    return task
+
+
+store = CptStore(args.store) if args.store is not None else None
+nemu_build = build_hash(exe) if store is not None else None
+n_stored = 0
+points_of_workload = {}
+indexes = {}
 for workload, point_file, weight_file in \
         find_simpoint_analysis_files(simpoint_dir):
-    workload_cpts = avail_cpts[workload]
-    print(workload)
-    with_cpt = 0
-    without_cpt = 0
+    indexes[workload] = CptSourceIndex(avail_cpts[workload])
+    points = {}
     for interval, weight, start, actual_warmup in parse_simpoint_analysis_file(
             point_file, weight_file,
             interval_length=50*10**6,
             warmup_length=50*10**6,
             ):
         phased_workload = f'{workload}_{start}_{weight}'
+        if store is not None and store.materialize('simpoint', workload, start,
+                osp.join(top_output_dir, batch_task_name, phased_workload, '0'), nemu_build):
+            n_stored += 1
+            continue
         if start == 0:
             start = 1000
-        task = SimulatorTask(exe, top_output_dir,
-                task_name=batch_task_name,
-                workload=phased_workload,
-                sub_phase=start,
-                avoid_repeat=True,
-                )
-        task.workload_level_path_format()
-        task.set_trivial_workdir()
-        task.add_direct_options([
-            f'/home51/zyy/projects/NEMU/bbl_kernel_gen/spec{ver}_bbl/{workload}.bbl.bin',
-            ])
-        task.add_dict_options({
-            '-D': top_output_dir,
-            '-C': batch_task_name,
-            '-w': phased_workload,
-            '--sdcard-img': '/home51/zyy/projects/NEMU/rv-debian-spec-6G-fix-sphinx.img',
-            })
-        task.add_list_options([
-            '-b',
-            ])
-
-        # print(start)
-        last = 0
-        for k in reversed(sorted(workload_cpts.keys())):
-            if k <= start:
-                # print(f'To gen cpt@{start}, we start @{k} with {workload_cpts[k]}')
-                last = k
-                break
-        if last == 0:
-            without_cpt += 1
-
-        else:
-            with_cpt += 1
-            task.add_dict_options({
-                '-c': workload_cpts[last]
-                })
-
-        task.add_dict_options({  # How many instructions have to execute before take cpt
-            '--checkpoint-interval': start - last + 1000,
-            '--max-insts': start - last + 1500,
-            })
-
-        task.format_options(space=True)
-        task.dry_run = False
-        batch_tasks.append(task)
-    print(f'{with_cpt} tasks with cpt, {without_cpt} tasks without cpt, {with_cpt + without_cpt} in total')
+        points[start] = phased_workload
+    points_of_workload[workload] = points
+if store is not None:
+    print(f'{n_stored} simpoints linked from {args.store}')
+
+batch_jobs = []
+if args.multi:
+    chains_of_workload = plan_balanced_chains(
+            {w: list(points.keys()) for w, points in points_of_workload.items()},
+            indexes, args.threads)
+else:
+    chains_of_workload = {w: plan_workload(points.keys(), indexes[w])
+            for w, points in points_of_workload.items()}
+
+total_ff = 0
+for workload, points in points_of_workload.items():
+    print(workload)
+    chains = chains_of_workload[workload]
+    for chain in chains:
+        # -c, --checkpoint-interval and --max-insts are set by run_cpt_chain
+        batch_jobs.append([(make_task(workload, points[plan.start], plan.start), plan)
+            for plan in chain])
+
+    with_cpt = sum(plan.source_point > 0 for chain in chains for plan in chain)
+    n_chained, ff = plan_summary(chains)
+    total_ff += ff
+    print(f'{with_cpt} tasks with cpt ({n_chained} from cpts of this batch), '
+            f'{len(points) - with_cpt} tasks without cpt, {len(points)} in total, '
+            f'{len(chains)} chains, {ff} insts to fast-forward')
+print(f'{total_ff} insts to fast-forward in total')
+
+# long chains first, so that they do not hold the tail of the batch
+batch_jobs.sort(key=lambda chain: sum(plan.fast_forward for _, plan in chain), reverse=True)
 
 debug = False
 if debug:
-    task_wrapper(batch_tasks[0])
+    run_cpt_chain(batch_jobs[0])
     # results = map(task_wrapper, batch_tasks[:10])
     # for res in results:
     #     print(res)
 else:
-    p = Pool(80)
+    p = pinned_pool(args.threads)
 
-    results = p.map(task_wrapper, batch_tasks, chunksize=1)
+    results = p.imap_unordered(run_cpt_chain, batch_jobs, chunksize=1)
 
     count = 0
     for res in results:
         print(res)
         count += 1
 
-    print(f'Finished {count} simulations')
+    print(f'Finished {count} NEMU jobs')
     p.close()
+
+    if store is not None:
+        n = store.add_tree(osp.join(top_output_dir, batch_task_name), 'simpoint', nemu_build)
+        print(f'{n} checkpoints in {args.store}')
@@ -9,14 +9,23 @@ from pprint import pprint
 from multiprocessing import Pool
 
 from common.simulator_task import SimulatorTask, task_wrapper
+from common.slot_allocator import pinned_pool
 from common.task_tree import task_tree_to_batch_task
 from gem5tasks.typical_o3_config import TypicalO3Config
+from nemutasks.cpt_planner import CptSourceIndex, plan_balanced_segments
+from nemutasks.uniform_plan import plan_uniform, totals_from_inst_count
 
 # NEMU batch
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-v', '--spec-version', help='`06` or `17`',
         type=str, action='store', required=True, choices=['06', '17'])
+parser.add_argument('-M', '--multi', action='store_true',
+        help='take checkpoints of several chunks in one NEMU run')
+parser.add_argument('-j', '--threads', type=int, action='store', default=60)
+parser.add_argument('-I', '--inst-count', action='store_true',
+        help='cover the instruction counts in spec2017rate_inst_count.txt '
+        'instead of stopping at the largest available checkpoint')
 args = parser.parse_args()
 ver = args.spec_version
 
@@ -52,63 +61,73 @@ def get_avail_cpts(d):
 avail_cpts = get_avail_cpts(avail_cpt_dir)
 # print(avail_cpts)
 
+def make_task(workload, phased_workload, start):
+    task = SimulatorTask(exe, top_output_dir,
+            task_name=batch_task_name,
+            workload=phased_workload,
+            sub_phase=start,
+            avoid_repeat=True,
+            )
+    task.workload_level_path_format()
+    task.set_trivial_workdir()
+    task.add_direct_options([
+        f'/home51/zyy/projects/NEMU/bbl_kernel_gen/spec{ver}_bbl/{workload}.bbl.bin',
+        ])
+    task.add_dict_options({
+        '-D': top_output_dir,
+        '-C': batch_task_name,
+        '-w': phased_workload,
+        '--sdcard-img': '/home51/zyy/projects/NEMU/rv-debian-spec-6G-fix-sphinx.img',
+        })
+    task.add_list_options([
+        '-b',
+        ])
+    task.dry_run = False
+    return task
+
+
 batch_tasks = []
 inst_chunksize = 8000000000
 # for workload in ['bzip2_liberty']:
-for workload in os.listdir(avail_cpt_dir):
-    workload_cpts = avail_cpts[workload]
-    with_cpt = 0
-    without_cpt = 0
-    largest_cpt_point = sorted(workload_cpts.keys())[-1]
-    for start in np.arange(inst_chunksize//10, largest_cpt_point, inst_chunksize):
-        phased_workload = f'{workload}_{start // inst_chunksize * inst_chunksize}'
-        if start == 0:
-            start = 1000
-        task = SimulatorTask(exe, top_output_dir,
-                task_name=batch_task_name,
-                workload=phased_workload,
-                sub_phase=start,
-                avoid_repeat=True,
-                )
-        task.workload_level_path_format()
-        task.set_trivial_workdir()
-        task.add_direct_options([
-            f'/home51/zyy/projects/NEMU/bbl_kernel_gen/spec{ver}_bbl/{workload}.bbl.bin',
-            ])
+totals = totals_from_inst_count(avail_cpts.keys()) if args.inst_count else None
+plan = plan_uniform(avail_cpts, inst_chunksize, totals)
+starts_of_workload = plan.starts_of_workload()
+
+if args.multi:
+    # periodic checkpoints of consecutive chunks are taken by one NEMU run
+    segments = plan_balanced_segments(starts_of_workload,
+            {w: CptSourceIndex(avail_cpts[w]) for w in starts_of_workload}, args.threads,
+            tail=inst_chunksize)
+    for seg in segments:
+        phased_workload = f'{seg.workload}_{seg.points[0] // inst_chunksize * inst_chunksize}'
+        task = make_task(seg.workload, phased_workload, seg.points[0])
+        if seg.source_file is not None:
+            task.add_dict_options({
+                '-c': seg.source_file
+                })
         task.add_dict_options({
-            '-D': top_output_dir,
-            '-C': batch_task_name,
-            '-w': phased_workload,
-            '--sdcard-img': '/home51/zyy/projects/NEMU/rv-debian-spec-6G-fix-sphinx.img',
+            '--checkpoint-interval': inst_chunksize//10,
+            '--max-insts': int(seg.points[-1] - seg.source_point + inst_chunksize * 1.0002),
             })
-        task.add_list_options([
-            '-b',
-            ])
-
-        # print(start)
-        last = 0
-        for k in reversed(sorted(workload_cpts.keys())):
-            if k <= start:
-                print(f'To gen cpt@{start}, we start @{k} with {workload_cpts[k]}')
-                last = k
-                break
-        if last == 0:
-            without_cpt += 1
-        else:
-            with_cpt += 1
+        task.format_options(space=True)
+        batch_tasks.append(task)
+    print(f'{len(segments)} NEMU runs for {sum(len(s) for s in starts_of_workload.values())} chunks, '
+            f'{sum(seg.span for seg in segments)} insts to simulate in total')
+
+else:
+    plan.report()
+    for workload, start, phase, source_point, source_file, ff in plan.rows():
+        task = make_task(workload, f'{workload}_{phase}', start)
+        if source_file is not None:
             task.add_dict_options({
-                '-c': workload_cpts[last]
+                '-c': source_file
                 })
-
         task.add_dict_options({  # How many instructions have to execute before take cpt
             '--checkpoint-interval': inst_chunksize//10,
-            '--max-insts':  int(inst_chunksize * 1.0002),
+            '--max-insts': plan.max_insts,
             })
-
         task.format_options(space=True)
-        task.dry_run = False
         batch_tasks.append(task)
-    print(f'{with_cpt} tasks with cpt, {without_cpt} tasks without cpt, {with_cpt + without_cpt} in total')
 
 # sys.exit(0)
 debug = False
@@ -118,9 +137,9 @@ if debug:
     # for res in results:
     #     print(res)
 else:
-    p = Pool(60)
+    p = pinned_pool(args.threads)
 
-    results = p.map(task_wrapper, batch_tasks, chunksize=1)
+    results = p.imap_unordered(task_wrapper, batch_tasks, chunksize=1)
 
     count = 0
     for res in results:
@@ -0,0 +1,82 @@
+import numpy as np
+
+from common.task_cost import load_inst_counts, benchmark_of
+
+# Planning uniform checkpoint generation for all workloads at once.
+# Segment i of a workload starts at inst_chunksize//10 + i * inst_chunksize,
+# restores from the nearest available (sparse) checkpoint at or before its
+# start, found with np.searchsorted, and simulates max_insts instructions.
+
+
+def totals_from_inst_count(workloads, inst_count_file=None):
+    # instruction count of each workload from spec2017rate_inst_count.txt (trillions)
+    inst_counts = load_inst_counts() if inst_count_file is None else load_inst_counts(inst_count_file)
+    totals = {}
+    for workload in workloads:
+        benchmark = benchmark_of(workload, inst_counts)
+        if benchmark is not None:
+            totals[workload] = int(inst_counts[benchmark] * 10**12)
+    return totals
+
+
+class UniformPlan:
+    def __init__(self, inst_chunksize, max_insts, columns: dict):
+        self.inst_chunksize = inst_chunksize
+        self.max_insts = max_insts
+        # workload, start, phase, source_point, source_file, fast_forward
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['start'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows(self):
+        c = self.columns
+        return zip(c['workload'].tolist(), c['start'].tolist(), c['phase'].tolist(),
+                c['source_point'].tolist(), c['source_file'], c['fast_forward'].tolist())
+
+    def starts_of_workload(self):
+        return {str(w): self['start'][self['workload'] == w].tolist()
+                for w in np.unique(self['workload'])}
+
+    def report(self):
+        with_cpt = int(np.count_nonzero(self['source_point'] > 0))
+        print(f'{len(self)} segments of {len(np.unique(self["workload"]))} workloads, '
+                f'{with_cpt} with cpt, {len(self) - with_cpt} without cpt')
+        print(f'{int(self["fast_forward"].sum())} insts between restore points and segment starts, '
+                f'{len(self) * self.max_insts} insts to simulate in total')
+
+
+def plan_uniform(avail_cpts: dict, inst_chunksize, totals=None, max_insts=None):
+    # avail_cpts: workload -> {inst: cpt file}
+    # totals: workload -> instruction count, default to the largest available checkpoint
+    if max_insts is None:
+        max_insts = int(inst_chunksize * 1.0002)
+    columns = {k: [] for k in ['workload', 'start', 'source_point', 'source_file']}
+    for workload, cpts in avail_cpts.items():
+        points = np.array(sorted(cpts.keys()), dtype=np.int64)
+        if totals is not None and workload in totals:
+            total = totals[workload]
+        elif len(points):
+            total = int(points[-1])
+        else:
+            continue
+        starts = np.arange(inst_chunksize//10, total, inst_chunksize, dtype=np.int64)
+        starts[starts == 0] = 1000
+        idx = np.searchsorted(points, starts, side='right') - 1
+        files = np.array([cpts[p] for p in points.tolist()] + [None], dtype=object)
+        columns['workload'].append(np.full(len(starts), workload, dtype=object))
+        columns['start'].append(starts)
+        # idx -1 picks the trailing None
+        columns['source_point'].append(np.where(idx >= 0, points[np.maximum(idx, 0)], 0)
+                if len(points) else np.zeros(len(starts), dtype=np.int64))
+        columns['source_file'].append(files[idx])
+    columns = {k: np.concatenate(v) if len(v) else
+            np.array([], dtype=object if k in ['workload', 'source_file'] else np.int64)
+            for k, v in columns.items()}
+    columns['workload'] = columns['workload'].astype(str)
+    columns['phase'] = columns['start'] // inst_chunksize * inst_chunksize
+    columns['fast_forward'] = columns['start'] - columns['source_point']
+    return UniformPlan(inst_chunksize, max_insts, columns)